@@ -1,10 +1,10 @@
 import numpy as np
+from collections import OrderedDict
+from functools import lru_cache
 from math import log10
 from typing import List
 
-from scipy.spatial import ConvexHull
-
-from DataModel import MaterialItem
+from scipy.spatial import ConvexHull, QhullError
 
 
 class simpleEllipse:
@@ -22,21 +22,249 @@ class simpleEllipse:
         self.upper_left_x = x - w / 2.
         self.upper_left_y = y - h / 2.
 
-def ellipseHull(ellipses: List[simpleEllipse], expand_ratio, step):
-    if len(ellipses) == 0:
+class LRUCache(object):
+    '''
+    Memo of at most `max_entries` values, the least recently used entry is evicted first.
+    '''
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, key, default=None):
+        try:
+            self.entries.move_to_end(key)
+        except KeyError:
+            self.misses += 1
+            return default
+        self.hits += 1
+        return self.entries[key]
+
+    def put(self, key, value):
+        self.entries[key] = value
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    def clear(self):
+        self.entries.clear()
+
+
+# Families smaller than this are sampled completely, pruning would not pay off.
+PRUNE_MIN_ELLIPSES = 32
+# Number of directions used to pick the extreme ellipses spanning the inner hull.
+PRUNE_DIRECTIONS = 16
+# Upper bound of the (ellipses x corners x facets) block evaluated at once while pruning.
+PRUNE_BLOCK_SIZE = 1 << 22
+# Upper bound of the boundary points sampled at once, an (n x step x 2) block stays below 64 MiB.
+SAMPLE_BLOCK_POINTS = 1 << 22
+# Bounds of the adaptive per-ellipse sampling step.
+MIN_SAMPLING_STEP = 8
+MAX_SAMPLING_STEP = 4096
+
+
+def ellipseArrays(ellipses: List[simpleEllipse]):
+    '''
+    Centers (n x 2), sizes (n x 2, full width and height) and rotations (n, degrees) of the ellipses.
+    '''
+    centers = np.array([(ellipse.x, ellipse.y) for ellipse in ellipses], dtype=np.float64).reshape(-1, 2)
+    sizes = np.array([(ellipse.w, ellipse.h) for ellipse in ellipses], dtype=np.float64).reshape(-1, 2)
+    rotations = np.array([ellipse.rotation or 0. for ellipse in ellipses], dtype=np.float64)
+    return centers, sizes, rotations
+
+
+@lru_cache(maxsize=16)
+def unitCircleTable(step):
+    '''
+    sin and cos of `step` angles evenly spaced over [0, 2 pi], shared by every sampling of that step.
+    '''
+    t = np.linspace(0, 2 * np.pi, step)
+    table = np.stack((np.sin(t), np.cos(t)))
+    table.setflags(write=False)
+    return table
+
+
+def sampleEllipses(centers: np.ndarray, sizes: np.ndarray, rotations: np.ndarray, expand_ratio, step):
+    '''
+    Boundary points of n ellipses at once as an (n x step x 2) array. An ellipse is rotated by
+    its angle in degrees around its center, the same way QGraphicsItem.setRotation draws it.
+    '''
+    sin_t, cos_t = unitCircleTable(step)
+    local_x = (sizes[:, 0:1] * (expand_ratio / 2.)) * sin_t
+    local_y = (sizes[:, 1:2] * (expand_ratio / 2.)) * cos_t
+    points = np.empty((len(centers), step, 2), dtype=np.float64)
+    theta = np.radians(np.nan_to_num(np.asarray(rotations, dtype=np.float64)))
+    if not theta.any():
+        np.add(local_x, centers[:, 0:1], out=points[:, :, 0])
+        np.add(local_y, centers[:, 1:2], out=points[:, :, 1])
+        return points
+    cos_r = np.cos(theta)[:, None]
+    sin_r = np.sin(theta)[:, None]
+    points[:, :, 0] = local_x * cos_r - local_y * sin_r + centers[:, 0:1]
+    points[:, :, 1] = local_x * sin_r + local_y * cos_r + centers[:, 1:2]
+    return points
+
+
+def iterEllipseSamples(centers: np.ndarray, sizes: np.ndarray, rotations: np.ndarray, expand_ratio, step,
+                       block_points: int = SAMPLE_BLOCK_POINTS):
+    '''
+    sampleEllipses in blocks of at most `block_points` points, yields (k x step x 2) arrays.
+    `step` is one count for all ellipses or an array with the count of each ellipse.
+    '''
+    if np.ndim(step) == 0:
+        groups = [(int(step), slice(None))]
+    else:
+        steps = np.asarray(step)
+        groups = [(int(value), np.flatnonzero(steps == value)) for value in np.unique(steps)]
+    for value, rows in groups:
+        group_centers, group_sizes, group_rotations = centers[rows], sizes[rows], rotations[rows]
+        block = max(1, block_points // max(value, 1))
+        for start in range(0, len(group_centers), block):
+            yield sampleEllipses(group_centers[start:start + block], group_sizes[start:start + block],
+                                 group_rotations[start:start + block], expand_ratio, value)
+
+
+def adaptiveSamplingSteps(sizes: np.ndarray, expand_ratio, max_error):
+    '''
+    Per-ellipse sampling step keeping the chord error below `max_error` scene units. A chord over
+    the angle 2 pi / k of a circle of radius r deviates at most r (1 - cos(pi / k)) from the arc, the
+    larger semi axis stands in for r. Steps are rounded up to powers of two to share sin/cos tables.
+    '''
+    radius = np.abs(sizes).max(axis=1) * expand_ratio / 2.
+    with np.errstate(divide="ignore", invalid="ignore"):
+        segments = np.pi / np.arccos(np.clip(1. - max_error / radius, -1., 1.))
+        # linspace repeats the first point at the end, so k segments take k + 1 samples.
+        steps = 2 ** np.ceil(np.log2(segments + 1.))
+    steps = np.nan_to_num(steps, nan=MIN_SAMPLING_STEP, posinf=MAX_SAMPLING_STEP)
+    return np.clip(steps, MIN_SAMPLING_STEP, MAX_SAMPLING_STEP).astype(np.intp)
+
+
+def pruneInteriorEllipses(centers: np.ndarray, sizes: np.ndarray, rotations: np.ndarray, expand_ratio, step):
+    '''
+    Return the indexes of the ellipses which can contribute a vertex to the hull of all sampled points.
+    A few extreme ellipses are sampled to build an inner hull, every ellipse whose expanded
+    bounding box lies strictly inside it is interior, so the final hull stays exactly the same.
+    '''
+    if len(centers) < PRUNE_MIN_ELLIPSES:
+        return np.arange(len(centers))
+    half_axes = np.abs(sizes) / 2 * expand_ratio
+    theta = np.radians(np.nan_to_num(rotations))
+    cos_r = np.cos(theta)[:, None]
+    sin_r = np.sin(theta)[:, None]
+    # The ellipse reaching farthest in a direction d has the largest support c.d + |(a u, b v)|,
+    # where (u, v) is d in the frame of the rotated ellipse.
+    angles = np.linspace(0, 2 * np.pi, PRUNE_DIRECTIONS, endpoint=False)
+    dx, dy = np.cos(angles), np.sin(angles)
+    support = centers @ np.stack((dx, dy)) + np.hypot(half_axes[:, :1] * (dx * cos_r + dy * sin_r),
+                                                      half_axes[:, 1:] * (dy * cos_r - dx * sin_r))
+    seeds = np.unique(np.argmax(support, axis=0))
+    seed_steps = step if np.ndim(step) == 0 else np.asarray(step)[seeds]
+    try:
+        inner = ConvexHull(np.concatenate([samples.reshape(-1, 2) for samples in iterEllipseSamples(
+            centers[seeds], sizes[seeds], rotations[seeds], expand_ratio, seed_steps)]))
+    except QhullError:
+        # All seeds are (nearly) collinear, nothing can be proven to be interior.
+        return np.arange(len(centers))
+    normals = inner.equations[:, :2]
+    offsets = inner.equations[:, 2]
+    extent = np.ptp(inner.points, axis=0).max()
+    tolerance = 1e-9 * max(extent, 1.)
+    # Half extents of the axis-aligned box around each rotated ellipse.
+    box = np.concatenate((np.hypot(half_axes[:, :1] * cos_r, half_axes[:, 1:] * sin_r),
+                          np.hypot(half_axes[:, :1] * sin_r, half_axes[:, 1:] * cos_r)), axis=1)
+    corners = np.stack((centers - box, centers + box * [1, -1],
+                        centers + box, centers + box * [-1, 1]), axis=1)
+    keep = np.ones(len(centers), dtype=bool)
+    block = max(1, PRUNE_BLOCK_SIZE // (4 * len(offsets)))
+    for start in range(0, len(centers), block):
+        distances = corners[start:start + block] @ normals.T + offsets
+        keep[start:start + block] = ~np.all(distances < -tolerance, axis=(1, 2))
+    keep[seeds] = True
+    return np.flatnonzero(keep)
+
+
+def ellipseHullArrays(centers: np.ndarray, sizes: np.ndarray, rotations: np.ndarray, expand_ratio, step):
+    '''
+    Hull vertices of the sampled ellipses, `step` may hold one sampling step per ellipse.
+    Points are sampled block by block and only the hull vertices of each block are kept
+    once there are many points, so peak memory does not grow with the number of ellipses.
+    '''
+    if len(centers) == 0:
         return None
-    pts = []
-    for i, ellipse in enumerate(ellipses):
-        t = np.linspace(0, 2 * np.math.pi, step)
-        # Sample points along the surface of the ellipse.
-        x = ellipse.w * np.sin(t) / 2 * expand_ratio + ellipse.x
-        y = ellipse.h * np.cos(t) / 2 * expand_ratio + ellipse.y
-        xy = np.stack((x, y)).T
-        if ellipse.rotation is not None:
-            # TODO(cow) rotation points
-            pass
-        pts.append(xy)
-    pts = np.concatenate(pts, axis=0)
+    rows = pruneInteriorEllipses(centers, sizes, rotations, expand_ratio, step)
+    steps = step if np.ndim(step) == 0 else np.asarray(step)[rows]
+    reduce_blocks = np.sum(np.broadcast_to(steps, rows.shape)) > SAMPLE_BLOCK_POINTS
+    blocks = []
+    for samples in iterEllipseSamples(centers[rows], sizes[rows], rotations[rows], expand_ratio, steps):
+        pts = samples.reshape(-1, 2)
+        if reduce_blocks:
+            try:
+                pts = pts[ConvexHull(pts).vertices]
+            except QhullError:
+                pass
+        blocks.append(pts)
+    pts = np.concatenate(blocks) if len(blocks) > 1 else blocks[0]
     hull = ConvexHull(pts)
 
     return pts[hull.vertices]
+
+
+def computeEllipseHull(centers: np.ndarray, sizes: np.ndarray, rotations: np.ndarray, expand_ratio, step,
+                       max_error=None, tolerance=None):
+    '''
+    Hull vertices with the sampling step chosen per ellipse for `max_error` and the outline
+    simplified to `tolerance` (both in scene units) when given. Only touches its arguments,
+    so it is safe to run in a worker thread.
+    '''
+    if max_error:
+        step = adaptiveSamplingSteps(sizes, expand_ratio, max_error)
+    hull_v = ellipseHullArrays(centers, sizes, rotations, expand_ratio, step)
+    if tolerance and hull_v is not None:
+        hull_v = simplifyPolygon(hull_v, tolerance)
+    return hull_v
+
+
+def ellipseHull(ellipses: List[simpleEllipse], expand_ratio, step):
+    if len(ellipses) == 0:
+        return None
+    return ellipseHullArrays(*ellipseArrays(ellipses), expand_ratio, step)
+
+
+def simplifyPolygon(points: np.ndarray, tolerance):
+    '''
+    Douglas-Peucker simplification of a closed polygon: every dropped vertex lies within
+    `tolerance` of the returned outline.
+    '''
+    count = len(points)
+    if count <= 3 or not tolerance > 0:
+        return points
+    # Split the ring at the vertex farthest from the first one and simplify both halves.
+    far = int(np.argmax(np.hypot(*(points - points[0]).T)))
+    ring = np.concatenate((points, points[:1]))
+    keep = np.zeros(count + 1, dtype=bool)
+    keep[[0, far, count]] = True
+    stack = [(0, far), (far, count)]
+    while stack:
+        first, last = stack.pop()
+        if last - first < 2:
+            continue
+        start = ring[first]
+        chord = ring[last] - start
+        offsets = ring[first + 1:last] - start
+        length = np.hypot(*chord)
+        if length > 0:
+            distances = np.abs(chord[0] * offsets[:, 1] - chord[1] * offsets[:, 0]) / length
+        else:
+            distances = np.hypot(*offsets.T)
+        farthest = int(np.argmax(distances))
+        if distances[farthest] > tolerance:
+            middle = first + 1 + farthest
+            keep[middle] = True
+            stack.extend(((first, middle), (middle, last)))
+    simplified = points[keep[:count]]
+    return simplified if len(simplified) >= 3 else points
@@ -0,0 +1,67 @@
+# -*- coding:utf-8 -*-
+import os
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable
+
+from PySide2.QtCore import QObject, Signal
+
+
+class BackgroundTasks(QObject):
+    '''
+    Runs callables in a thread pool and hands their results back on the Qt thread through
+    `finished(tag, result)` or `failed(tag, message)`, as soon as each one is done.
+    cancel() starts a new generation: queued work is dropped and results of older work are
+    never delivered, e.g. after the config or the dataset changed.
+    '''
+    finished = Signal(object, object)
+    failed = Signal(object, str)
+    # Emitted from the worker threads, the queued connection moves it to the thread of this object.
+    delivered = Signal(int, object, object, object)
+
+    def __init__(self, max_workers: int = None, parent: QObject = None):
+        super(BackgroundTasks, self).__init__(parent)
+        self.pool = ThreadPoolExecutor(max_workers=max_workers or os.cpu_count() or 1)
+        self.generation = 0
+        self.futures = set()
+        self.delivered.connect(self.onDelivered)
+
+    #
+    # Public
+    #
+    def submit(self, tag, function: Callable, *args):
+        generation = self.generation
+        future = self.pool.submit(function, *args)
+        self.futures.add(future)
+        future.add_done_callback(lambda future: self.deliver(generation, tag, future))
+        return future
+
+    def cancel(self):
+        self.generation += 1
+        for future in self.futures:
+            future.cancel()
+        self.futures.clear()
+
+    def pendingCount(self):
+        return len(self.futures)
+
+    def shutdown(self):
+        self.cancel()
+        self.pool.shutdown(wait=False)
+
+    #
+    # Private
+    #
+    def deliver(self, generation: int, tag, future: Future):
+        if future.cancelled():
+            return
+        error = future.exception()
+        self.delivered.emit(generation, tag, future, None if error is None else "%s: %s" % (type(error).__name__, error))
+
+    def onDelivered(self, generation: int, tag, future: Future, error):
+        if generation != self.generation:
+            return
+        self.futures.discard(future)
+        if error is None:
+            self.finished.emit(tag, future.result())
+        else:
+            self.failed.emit(tag, error)
@@ -0,0 +1,423 @@
+# -*- coding:utf-8 -*-
+'''
+Micro-benchmarks for the data and drawing pipelines.
+Run e.g. `python Benchmark.py load` and compare the numbers before/after a change.
+'''
+import os
+import shutil
+import sys
+import tempfile
+from contextlib import redirect_stdout
+from io import StringIO
+from time import perf_counter
+
+import numpy as np
+import pandas as pd
+
+from DataIngestion import aggregateFiles, listSources
+from DataModel import AshbyModel
+
+LOAD_SIZES = [1000, 10000, 100000]
+SAMPLES_PER_MATERIAL = 2
+STREAM_CHUNK_ROWS = 20000
+
+
+def makeSampleCSV(material_count: int, samples_per_material: int = SAMPLES_PER_MATERIAL, seed: int = 0):
+    '''
+    Write a synthetic raw-sample CSV shaped like test.csv and return its path.
+    '''
+    rng = np.random.default_rng(seed)
+    rows = material_count * samples_per_material
+    names = np.repeat(np.array(["Material %d" % i for i in range(material_count)], dtype=object),
+                      samples_per_material)
+    families = np.array(["Metal", "Plastic", "Ceramic", "Composite"], dtype=object)
+    modulus = rng.uniform(1., 500., rows)
+    strength = rng.uniform(10., 4000., rows)
+    df = pd.DataFrame({
+        "Name": names,
+        "Density": rng.uniform(0.5, 20., rows),
+        "Modulus_mean": modulus,
+        # Keep the spread below the mean so that the ellipses stay positive in log scale.
+        "Modulus_sd": modulus * rng.uniform(0.05, 0.5, rows),
+        "Strength_mean": strength,
+        "Strength_sd": strength * rng.uniform(0.05, 0.5, rows),
+        "Thermal Conductivity": rng.uniform(0.1, 500., rows),
+        "Type": np.repeat(families[rng.integers(0, len(families), material_count)], samples_per_material),
+        "Color_R": rng.integers(0, 256, rows).astype(float),
+        "Color_G": rng.integers(0, 256, rows).astype(float),
+        "Color_B": rng.integers(0, 256, rows).astype(float),
+    })
+    fd, path = tempfile.mkstemp(suffix=".csv")
+    os.close(fd)
+    df.to_csv(path, index=False)
+    return path
+
+
+def benchmarkLoad(sizes=LOAD_SIZES):
+    print("%12s %12s %12s" % ("materials", "load [s]", "stream [s]"))
+    for size in sizes:
+        path = makeSampleCSV(size)
+        try:
+            with redirect_stdout(StringIO()):
+                start = perf_counter()
+                AshbyModel(path)
+                loaded = perf_counter()
+                AshbyModel(path, chunksize=STREAM_CHUNK_ROWS)
+                streamed = perf_counter()
+            print("%12d %12.3f %12.3f" % (size, loaded - start, streamed - loaded))
+        finally:
+            os.remove(path)
+    checkIntegerColumns()
+
+
+def checkIntegerColumns(material_count: int = 1000):
+    '''
+    Integer colors are descriptive: taken from the first sample, placed after the float means in file order.
+    '''
+    path = makeSampleCSV(material_count)
+    try:
+        samples = pd.read_csv(path)
+        colors = ["Color_R", "Color_G", "Color_B"]
+        samples[colors] = samples[colors].astype(np.int64)
+        samples.to_csv(path, index=False)
+        floats = [column for column in samples.columns if samples[column].dtype.kind == "f"]
+        first = samples.groupby("Name").first()
+        for chunksize in (None, material_count // 3):
+            with redirect_stdout(StringIO()):
+                model = AshbyModel(path, chunksize=chunksize)
+            table = model.getTable()
+            assert (table.colors == first.loc[table.labels, colors].values).all(), "colors are not the first sample"
+            assert list(model.data.columns) == floats + [column for column in samples.columns if column not in floats]
+            assert model.getNumericColumns() == floats and model.getStringColumn() == ["Name", "Type"]
+    finally:
+        os.remove(path)
+
+
+def benchmarkFiles(material_count: int = 100000, file_count: int = 16):
+    '''
+    Multi-file ingestion with a growing process pool. A stray file with another key column sorts
+    first in the folder, only that file may fail.
+    '''
+    path = makeSampleCSV(material_count, samples_per_material=4)
+    directory = tempfile.mkdtemp()
+    try:
+        samples = pd.read_csv(path)
+        for i, part in enumerate(np.array_split(samples, file_count)):
+            part.to_csv(os.path.join(directory, "part%03d.csv" % i), index=False)
+        stray = os.path.join(directory, "00_index.csv")
+        pd.DataFrame({"supplier": ["a", "b"], "files": [3, 4]}).to_csv(stray, index=False)
+        filenames = listSources(directory)
+        print("%12s %12s" % ("workers", "load [s]"))
+        workers = 1
+        while workers <= (os.cpu_count() or 1):
+            start = perf_counter()
+            aggregator, failures = aggregateFiles(filenames, max_workers=workers)
+            print("%12d %12.3f" % (workers, perf_counter() - start))
+            assert list(failures) == [stray] and aggregator.key == "Name", failures
+            assert len(aggregator.first) == material_count, len(aggregator.first)
+            workers *= 2
+    finally:
+        os.remove(path)
+        shutil.rmtree(directory)
+
+
+def loadModel(material_count: int):
+    path = makeSampleCSV(material_count, samples_per_material=1)
+    try:
+        with redirect_stdout(StringIO()):
+            return AshbyModel(path)
+    finally:
+        os.remove(path)
+
+
+def benchmarkTransform(material_count: int = 100000, scalar_count: int = 10000):
+    '''
+    Per-material cost of the batch transform against the scalar matToSquare/matCenterPoint path.
+    '''
+    from GraphicTransformer import GraphicConfig, GraphicTransformer
+    model = loadModel(material_count)
+    items = list(model.getAllItems().values())[:scalar_count]
+    print("%12s %14s %14s" % ("log scale", "scalar [us]", "batch [us]"))
+    for log_scale in (False, True):
+        config = GraphicConfig()
+        config.updateConfig(log_scale=log_scale)
+        transformer = GraphicTransformer(config)
+        start = perf_counter()
+        for item in items:
+            transformer.matToSquare(item)
+            transformer.matCenterPoint(item)
+            transformer.matRotation(item)
+        scalar = (perf_counter() - start) / len(items)
+        start = perf_counter()
+        transformer.transformAll(model)
+        batch = (perf_counter() - start) / material_count
+        print("%12s %14.3f %14.3f" % (log_scale, scalar * 1e6, batch * 1e6))
+
+
+def benchmarkHull(sizes=(1000, 10000, 50000), step: int = 200):
+    '''
+    Family hull of random ellipses with and without the interior pruning.
+    '''
+    import AlgorithmUtils
+    rng = np.random.default_rng(0)
+    print("%12s %12s %12s" % ("ellipses", "full [s]", "pruned [s]"))
+    for size in sizes:
+        ellipses = [AlgorithmUtils.simpleEllipse(x, y, w, h, 0.) for x, y, w, h in
+                    zip(rng.normal(0., 1., size), rng.normal(0., 1., size),
+                        rng.uniform(0.01, 0.3, size), rng.uniform(0.01, 0.3, size))]
+        min_ellipses = AlgorithmUtils.PRUNE_MIN_ELLIPSES
+        AlgorithmUtils.PRUNE_MIN_ELLIPSES = size + 1
+        start = perf_counter()
+        AlgorithmUtils.ellipseHull(ellipses, 2., step)
+        full = perf_counter() - start
+        AlgorithmUtils.PRUNE_MIN_ELLIPSES = min_ellipses
+        start = perf_counter()
+        AlgorithmUtils.ellipseHull(ellipses, 2., step)
+        print("%12d %12.3f %12.3f" % (size, full, perf_counter() - start))
+
+
+def benchmarkPolygon(sizes=(1000, 100000, 1000000)):
+    '''
+    NumPy vertices to QPolygonF and QPainterPath: one QPointF per vertex against the QDataStream buffer.
+    '''
+    from PySide2.QtCore import QPointF
+    from PySide2.QtGui import QPainterPath, QPolygonF
+    from QtGeometry import pathFromArray, polygonFromArray
+    rng = np.random.default_rng(0)
+    print("%12s %12s %12s %12s %12s" % ("vertices", "QPointF [s]", "buffer [s]", "path pts [s]", "path buf [s]"))
+    for size in sizes:
+        vertices = rng.normal(0., 1., (size, 2))
+        start = perf_counter()
+        expected = QPolygonF(list(map(QPointF, *vertices.T)))
+        points = perf_counter()
+        polygon = polygonFromArray(vertices)
+        buffer = perf_counter()
+        expected_path = QPainterPath(QPointF(*vertices[0]))
+        for x, y in vertices[1:]:
+            expected_path.lineTo(x, y)
+        expected_path.closeSubpath()
+        path_points = perf_counter()
+        path = pathFromArray(vertices)
+        path_buffer = perf_counter()
+        assert polygon == expected, "polygonFromArray differs at %d vertices" % size
+        assert path == expected_path, "pathFromArray differs at %d vertices" % size
+        print("%12d %12.4f %12.4f %12.4f %12.4f" % (size, points - start, buffer - points,
+                                                    path_points - buffer, path_buffer - path_points))
+
+
+def benchmarkLayer(material_count: int = 50000, visible_fractions=(0.01, 0.1, 1.)):
+    '''
+    Population and paint time of the material layer, painting views showing a growing share of the plot.
+    '''
+    from PySide2.QtCore import QRectF
+    from PySide2.QtGui import QImage, QPainter
+    from PySide2.QtWidgets import QApplication, QGraphicsScene
+    from GraphicTransformer import GraphicConfig, GraphicTransformer
+    from View.MaterialLayer import MaterialLayer
+    app = QApplication.instance() or QApplication([])
+    model = loadModel(material_count)
+    geometry = GraphicTransformer(GraphicConfig()).transformAll(model)
+    scene = QGraphicsScene()
+    layer = MaterialLayer()
+    scene.addItem(layer)
+    start = perf_counter()
+    layer.setGeometry(geometry.rects, geometry.rotations, model.getTable().colors, np.arange(material_count))
+    print("populate %d materials: %.3f s" % (material_count, perf_counter() - start))
+    bounds = layer.boundingRect()
+    image = QImage(800, 800, QImage.Format_ARGB32)
+    print("%12s %12s %12s" % ("visible", "materials", "paint [s]"))
+    for fraction in visible_fractions:
+        side = np.sqrt(fraction)
+        source = QRectF(bounds.center().x() - bounds.width() * side / 2., bounds.center().y() - bounds.height() * side / 2.,
+                        bounds.width() * side, bounds.height() * side)
+        painter = QPainter(image)
+        # The first render also sets up the scene, leave it out.
+        scene.render(painter, QRectF(image.rect()), source)
+        start = perf_counter()
+        scene.render(painter, QRectF(image.rect()), source)
+        elapsed = perf_counter() - start
+        painter.end()
+        print("%12.2f %12d %12.3f" % (fraction, len(layer.rowsIn(source)), elapsed))
+    checkRowAt(layer)
+
+
+def checkRowAt(layer, point_count: int = 500):
+    '''
+    Hit-test time of rowAt(), checked against containment in every drawn ellipse.
+    '''
+    from PySide2.QtCore import QPointF
+    rng = np.random.default_rng(0)
+    layer.hideRows(rng.choice(len(layer.rects), len(layer.rects) // 10, replace=False))
+    # Build the index here, not in the first timed hit-test.
+    layer.index()
+    bounds = layer.boundingRect()
+    # Half the points on material centers so most of them hit something.
+    picked = layer.rects[rng.integers(len(layer.rects), size=point_count // 2)]
+    centers = picked[:, :2] + picked[:, 2:] / 2.
+    points = np.vstack([centers, rng.uniform((bounds.left(), bounds.top()), (bounds.right(), bounds.bottom()),
+                                             (point_count - len(centers), 2))])
+    x, y, w, h = layer.rects.T
+    theta = np.radians(layer.rotations)
+    drawn = np.flatnonzero(layer.drawn)
+    hits = 0
+    elapsed = 0.
+    for px, py in points:
+        start = perf_counter()
+        row = layer.rowAt(QPointF(px, py))
+        elapsed += perf_counter() - start
+        # The same point in the frame of every ellipse, as painted with QPainter.rotate().
+        dx, dy = px - (x + w / 2.), py - (y + h / 2.)
+        u = dx * np.cos(theta) + dy * np.sin(theta)
+        v = -dx * np.sin(theta) + dy * np.cos(theta)
+        inside = drawn[(2. * u[drawn] / w[drawn]) ** 2 + (2. * v[drawn] / h[drawn]) ** 2 <= 1.]
+        expected = int(inside[-1]) if len(inside) else -1
+        assert row == expected, "rowAt(%g, %g) is %d, brute force finds %d" % (px, py, row, expected)
+        hits += row >= 0
+    print("rowAt %d points, %d hits: %.1f us per point" % (len(points), hits, elapsed / len(points) * 1e6))
+
+
+def benchmarkViewport(frames: int = 50):
+    '''
+    Viewport mappings per panned frame against the number of reads of the viewport state.
+    '''
+    from PySide2.QtCore import QPointF
+    from PySide2.QtWidgets import QApplication, QGraphicsScene
+    from View.AGraphicsView import AGraphicsView
+    app = QApplication.instance() or QApplication([])
+    scene = QGraphicsScene()
+    view = AGraphicsView(None)
+    view.setScene(scene)
+    view.resize(800, 800)
+    view.show()
+    app.processEvents()
+    view.initHelperItems()
+    view.resetView()
+    reads = [0]
+    viewport_state = view.viewportState
+
+    def countedViewportState():
+        reads[0] += 1
+        return viewport_state()
+    view.viewportState = countedViewportState
+    view.viewportMappings = 0
+    start = perf_counter()
+    for _ in range(frames):
+        view.viewPosInScene += QPointF(0.01, 0.01)
+        view.resetSceneRect()
+        view.grab()
+    elapsed = perf_counter() - start
+    print("%12s %12s %12s" % ("mappings", "reads", "frame [ms]"))
+    print("%12.1f %12.1f %12.3f" % (view.viewportMappings / frames, reads[0] / frames, elapsed / frames * 1e3))
+
+
+def benchmarkToggle(material_count: int = 20000, toggles: int = 4):
+    '''
+    Log/linear toggle of a drawn chart with hulls, the hull outlines follow in the background.
+    The hulls are drawn twice, after each toggle every hull polygon in the scene must show the new outline
+    and the view must be fitted to the hulls as drawn, not as they were when the toggle fitted it.
+    '''
+    from PySide2.QtCore import QPointF
+    from PySide2.QtWidgets import QApplication, QGraphicsPolygonItem
+    import main
+    main.app = QApplication.instance() or QApplication([])
+    path = makeSampleCSV(material_count, samples_per_material=1)
+    try:
+        with redirect_stdout(StringIO()):
+            window = main.MainWindow()
+            window.csv_fpath = path
+            window.controller = controller = main.AshbyGraphicsController(window, path)
+            window.onClickGenPropChrt()
+            window.onActionConvexHull()
+            window.onActionConvexHull()
+        print("%12s %12s %12s %12s" % ("log scale", "toggle [ms]", "hulls", "stale"))
+        for toggle in range(toggles):
+            log_scale = toggle % 2 == 1
+            start = perf_counter()
+            controller.updateConfig(log_scale=log_scale)
+            elapsed = perf_counter() - start
+            controller.fitView()
+            while controller.pendingHulls:
+                main.app.processEvents()
+            view = window.ui.graphicsView
+            fitted = (view.viewScale, QPointF(view.viewPosInScene))
+            view.fitView()
+            assert (view.viewScale, view.viewPosInScene) == fitted, "view not fitted to the drawn hulls"
+            polygons = [item for item in window.myScene.items() if isinstance(item, QGraphicsPolygonItem)]
+            expected = [controller.transformer.getEllipseHull(group, controller.model)
+                        for group, _ in controller.hullItems.values()]
+            stale = [poly for poly in polygons if poly.polygon() not in expected]
+            print("%12s %12.1f %12d %12d" % (log_scale, elapsed * 1e3, len(polygons), len(stale)))
+            assert len(polygons) == len(controller.hullItems) and not stale, "hull polygons out of date"
+    finally:
+        os.remove(path)
+
+
+def benchmarkPopulate(material_count: int = 100000):
+    '''
+    Time-sliced population of a large chart: number of slices, their median and the longest one,
+    then the slice building the index and the density decision.
+    '''
+    from PySide2.QtWidgets import QApplication
+    import main
+    main.app = QApplication.instance() or QApplication([])
+    path = makeSampleCSV(material_count, samples_per_material=1)
+    try:
+        with redirect_stdout(StringIO()):
+            window = main.MainWindow()
+            window.csv_fpath = path
+            window.controller = controller = main.AshbyGraphicsController(window, path)
+            controller.drawAllMaterialEclipses()
+        controller.populateTimer.stop()
+        slices = []
+        while controller.isPopulating():
+            start = perf_counter()
+            controller.populateSlice()
+            slices.append(perf_counter() - start)
+        # The index and the density decision follow in a slice of their own.
+        controller.densityTimer.stop()
+        start = perf_counter()
+        controller.syncDensity()
+        settle = perf_counter() - start
+        print("%12s %12s %12s %12s %12s" % ("materials", "slices", "median [ms]", "max [ms]", "settle [ms]"))
+        print("%12d %12d %12.1f %12.1f %12.1f" % (material_count, len(slices), np.median(slices) * 1e3,
+                                                  max(slices) * 1e3, settle * 1e3))
+    finally:
+        os.remove(path)
+
+
+def benchmarkTicks(frames: int = 1000):
+    '''
+    Tick layouts of a panned and zoomed axis, every frame queried by the axis and its grid lines.
+    '''
+    from View.TickLayout import TickEngine, TICK_MODE_LINEAR, TICK_MODE_LOGSCALE
+    print("%12s %12s %12s %12s" % ("mode", "misses", "hits", "frame [us]"))
+    for mode in (TICK_MODE_LINEAR, TICK_MODE_LOGSCALE):
+        engine = TickEngine()
+        start = perf_counter()
+        for frame in range(frames):
+            lower = -1. + frame * 0.002
+            upper = lower + 3. * 0.999 ** frame
+            for _ in range(2):
+                engine.layout(mode, lower, upper).visible(lower, upper)
+        elapsed = perf_counter() - start
+        print("%12d %12d %12d %12.2f" % (mode, engine.entries.misses, engine.entries.hits, elapsed / frames * 1e6))
+
+
+BENCHMARKS = {
+    "load": benchmarkLoad,
+    "files": benchmarkFiles,
+    "transform": benchmarkTransform,
+    "hull": benchmarkHull,
+    "polygon": benchmarkPolygon,
+    "layer": benchmarkLayer,
+    "viewport": benchmarkViewport,
+    "toggle": benchmarkToggle,
+    "populate": benchmarkPopulate,
+    "ticks": benchmarkTicks,
+}
+
+if __name__ == '__main__':
+    names = sys.argv[1:] or list(BENCHMARKS.keys())
+    for name in names:
+        print("== %s ==" % name)
+        BENCHMARKS[name]()
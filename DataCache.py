@@ -0,0 +1,175 @@
+# -*- coding:utf-8 -*-
+import glob
+import hashlib
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+from DataIngestion import DatasetSchema, SampleAggregator
+
+CACHE_DIR = os.environ.get("MATERIALPLOT_CACHE_DIR", os.path.join(os.path.expanduser("~"), ".materialplot", "cache"))
+CACHE_MAX_BYTES = 512 * 1024 * 1024
+CACHE_FORMAT_VERSION = 3
+# The content hash reads this many bytes from both the head and the tail of the source file.
+HASH_BLOCK_BYTES = 1024 * 1024
+
+
+class DataCache(object):
+    '''
+    Persistent cache of aggregated datasets, stored as uncompressed npz (one array per column).
+    An entry is keyed on the source path, size, mtime and a content hash, so reopening an
+    unchanged CSV skips parsing and aggregation. Least recently used entries are evicted
+    once the cache grows beyond `max_bytes`.
+    '''
+
+    def __init__(self, directory: str = CACHE_DIR, max_bytes: int = CACHE_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+
+    #
+    # Public
+    #
+    def load(self, filename: str):
+        '''
+        Return the cached SampleAggregator of the file, None on a miss.
+        '''
+        path = self.entryPath(filename)
+        if not os.path.exists(path):
+            return None
+        try:
+            with np.load(path, allow_pickle=False) as arrays:
+                aggregator = self.decode(arrays)
+        except (OSError, ValueError, KeyError):
+            # A truncated or outdated entry is just a miss.
+            self.remove(path)
+            return None
+        # Refresh the access time for the LRU eviction.
+        os.utime(path)
+        return aggregator
+
+    def store(self, filename: str, aggregator: SampleAggregator):
+        os.makedirs(self.directory, exist_ok=True)
+        # Older entries of the same source are stale now.
+        self.invalidate(filename)
+        path = self.entryPath(filename)
+        temp_path = path + ".tmp"
+        with open(temp_path, "wb") as f:
+            np.savez(f, **self.encode(aggregator))
+        os.replace(temp_path, path)
+        self.evict()
+
+    def invalidate(self, filename: str = None):
+        '''
+        Drop the entries of one source file, or the whole cache without a filename.
+        '''
+        pattern = self.sourcePrefix(filename) + "-*.npz" if filename else "*.npz"
+        for path in glob.glob(os.path.join(self.directory, pattern)):
+            self.remove(path)
+
+    def evict(self):
+        entries = []
+        for path in glob.glob(os.path.join(self.directory, "*.npz")):
+            stat = os.stat(path)
+            entries.append((stat.st_mtime, stat.st_size, path))
+        total = sum(entry[1] for entry in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            self.remove(path)
+            total -= size
+
+    #
+    # Private
+    #
+    @staticmethod
+    def remove(path: str):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    @staticmethod
+    def sourcePrefix(filename: str):
+        return hashlib.blake2b(os.path.abspath(filename).encode("utf-8"), digest_size=8).hexdigest()
+
+    @staticmethod
+    def contentHash(filename: str):
+        '''
+        Hash of the size and the first and last HASH_BLOCK_BYTES of the file. Together with the
+        mtime this catches edits without re-reading a multi-GB file on every open.
+        '''
+        digest = hashlib.blake2b(digest_size=16)
+        size = os.path.getsize(filename)
+        digest.update(str(size).encode())
+        with open(filename, "rb") as f:
+            digest.update(f.read(HASH_BLOCK_BYTES))
+            if size > HASH_BLOCK_BYTES:
+                f.seek(max(HASH_BLOCK_BYTES, size - HASH_BLOCK_BYTES))
+                digest.update(f.read())
+        return digest.hexdigest()
+
+    def entryPath(self, filename: str):
+        stat = os.stat(filename)
+        signature = "%s|%d|%d|%s|%d" % (os.path.abspath(filename), stat.st_size, stat.st_mtime_ns,
+                                        self.contentHash(filename), CACHE_FORMAT_VERSION)
+        entry = hashlib.blake2b(signature.encode("utf-8"), digest_size=16).hexdigest()
+        return os.path.join(self.directory, "%s-%s.npz" % (self.sourcePrefix(filename), entry))
+
+    @staticmethod
+    def encodeColumn(values: np.ndarray, kind: str):
+        # Strings are stored as fixed-width unicode plus a null mask, so no pickling is needed.
+        values = pd.Series(values)
+        if kind == "O":
+            mask = values.isna().values
+            return values.where(~mask, "").astype(str).values.astype("U"), mask
+        mask = values.isna().values
+        # An integer column with missing values, e.g. from a merged file lacking it, stays float64 to keep its NaNs.
+        dtype = np.int64 if kind == "i" and not mask.any() else np.float64
+        return values.values.astype(dtype), mask
+
+    @staticmethod
+    def decodeColumn(values: np.ndarray, mask: np.ndarray):
+        if values.dtype.kind == "U":
+            values = values.astype(object)
+            values[mask] = np.nan
+        return values
+
+    def encode(self, aggregator: SampleAggregator):
+        # Store the materials sorted, which is the order AshbyModel.data uses.
+        keys = aggregator.first.index.sort_values()
+        stat_columns = aggregator.stat_columns
+        meta = {
+            "version": CACHE_FORMAT_VERSION,
+            "key": aggregator.key,
+            "columns": aggregator.columns,
+            "schema": aggregator.schema.toDict(),
+            "stat_columns": stat_columns,
+            "sample_count": aggregator.sample_count,
+        }
+        arrays = {"meta": np.array(json.dumps(meta))}
+        kinds = aggregator.schema.kinds
+        arrays["keys"], arrays["keys_mask"] = self.encodeColumn(keys.values, kinds[aggregator.key])
+        for name in ("count", "mean", "m2"):
+            frame = getattr(aggregator, name)
+            arrays[name] = frame.reindex(index=keys, columns=stat_columns).values.astype(np.float64)
+        for i, column in enumerate(aggregator.columns):
+            arrays["first_%d" % i], arrays["first_%d_mask" % i] = self.encodeColumn(
+                aggregator.first[column].reindex(keys).values, kinds[column])
+        return arrays
+
+    def decode(self, arrays):
+        meta = json.loads(str(arrays["meta"]))
+        if meta["version"] != CACHE_FORMAT_VERSION:
+            raise ValueError("Outdated cache entry.")
+        aggregator = SampleAggregator(meta["key"], meta["columns"])
+        aggregator.schema = DatasetSchema.fromDict(meta["schema"])
+        aggregator.sample_count = meta["sample_count"]
+        keys = pd.Index(self.decodeColumn(arrays["keys"], arrays["keys_mask"]))
+        for name in ("count", "mean", "m2"):
+            setattr(aggregator, name, pd.DataFrame(arrays[name], index=keys, columns=meta["stat_columns"]))
+        aggregator.first = pd.DataFrame(
+            {column: self.decodeColumn(arrays["first_%d" % i], arrays["first_%d_mask" % i])
+             for i, column in enumerate(meta["columns"])}, index=keys, columns=meta["columns"])
+        return aggregator
@@ -0,0 +1,422 @@
+# -*- coding:utf-8 -*-
+import glob
+import io
+import multiprocessing
+import os
+import threading
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from typing import Callable, List
+
+import numpy as np
+import pandas as pd
+
+# Files bigger than this are streamed in chunks instead of being read at once.
+STREAMING_THRESHOLD_BYTES = 64 * 1024 * 1024
+DEFAULT_CHUNK_ROWS = 100000
+# Materials are keyed on this column, a folder load merges only the files keyed on it when any file is.
+EXPECTED_KEY_COLUMN = "Name"
+# completeLinesEnd reads the file backwards in blocks of this size.
+TAIL_BLOCK_BYTES = 64 * 1024
+# How often a parallel load checks whether it was cancelled while no file completes.
+CANCEL_POLL_SECONDS = 0.1
+
+
+class LoadCancelled(Exception):
+    pass
+
+
+class DatasetSchema(object):
+    '''
+    Column roles, dtypes, null counts and value ranges of a raw sample file.
+    It is filled chunk by chunk during ingestion, so asking for the columns never re-reads the CSV.
+    Float columns are the numeric features, integer columns such as colors or IDs are descriptive like strings.
+    '''
+    ROLE_KEY = "key"
+    ROLE_NUMERIC = "numeric"
+    ROLE_DESCRIPTIVE = "descriptive"
+    ROLE_STRING = "string"
+
+    def __init__(self, columns: List[str], key: str):
+        self.columns = list(columns)
+        self.key = key
+        # Parsed dtype kind of every column over all samples so far: "f"loat, "i"nteger or "O"bject.
+        self.kinds = {}
+        self.null_counts = {column: 0 for column in self.columns}
+        self.minimums = {}
+        self.maximums = {}
+        self.row_count = 0
+
+    def update(self, samples: pd.DataFrame):
+        self.row_count += len(samples)
+        for column in self.columns:
+            series = samples[column]
+            kind = series.dtype.kind
+            kind = "i" if kind in "iu" else kind if kind == "f" else "O"
+            self.null_counts[column] += int(series.isna().sum())
+            if kind != "O" and series.notna().any():
+                self.updateRange(column, kind, float(series.min()), float(series.max()))
+            else:
+                self.updateRange(column, kind)
+
+    def merge(self, other: "DatasetSchema"):
+        '''
+        Fold the schema of another file into this one, columns missing in either file count as nulls.
+        '''
+        if other.key != self.key:
+            raise ValueError("Key column '%s' does not match '%s'." % (other.key, self.key))
+        for column in self.columns:
+            if column not in other.columns:
+                self.null_counts[column] += other.row_count
+        for column in other.columns:
+            if column not in self.columns:
+                self.columns.append(column)
+                self.null_counts[column] = self.row_count
+            self.null_counts[column] += other.null_counts[column]
+            self.updateRange(column, other.kinds[column], other.minimums.get(column), other.maximums.get(column))
+        self.row_count += other.row_count
+
+    def updateRange(self, column: str, kind: str, minimum: float = None, maximum: float = None):
+        previous = self.kinds.get(column, kind)
+        if "O" in (kind, previous):
+            kind = "O"
+        elif "f" in (kind, previous):
+            kind = "f"
+        self.kinds[column] = kind
+        if kind == "O":
+            self.minimums.pop(column, None)
+            self.maximums.pop(column, None)
+        elif minimum is not None:
+            self.minimums[column] = min(minimum, self.minimums.get(column, np.inf))
+            self.maximums[column] = max(maximum, self.maximums.get(column, -np.inf))
+
+    def role(self, column: str):
+        if column == self.key:
+            return self.ROLE_KEY
+        kind = self.kinds.get(column, "O")
+        return {"f": self.ROLE_NUMERIC, "i": self.ROLE_DESCRIPTIVE}.get(kind, self.ROLE_STRING)
+
+    def dtype(self, column: str):
+        return {"f": "float64", "i": "int64"}.get(self.kinds.get(column), "object")
+
+    def isNumeric(self, column: str):
+        return self.kinds.get(column, "O") == "f"
+
+    def isParsedAsNumber(self, column: str):
+        return self.kinds.get(column, "O") != "O"
+
+    def numericColumns(self):
+        return [column for column in self.columns if self.isNumeric(column)]
+
+    def descriptiveColumns(self):
+        return [column for column in self.columns if not self.isNumeric(column)]
+
+    def stringColumns(self):
+        return [column for column in self.columns if not self.isParsedAsNumber(column)]
+
+    def toDict(self):
+        return {
+            "columns": self.columns,
+            "key": self.key,
+            "kinds": self.kinds,
+            "null_counts": self.null_counts,
+            "minimums": self.minimums,
+            "maximums": self.maximums,
+            "row_count": self.row_count,
+        }
+
+    @classmethod
+    def fromDict(cls, info: dict):
+        schema = cls(info["columns"], info["key"])
+        schema.kinds = info["kinds"]
+        schema.null_counts = info["null_counts"]
+        schema.minimums = info["minimums"]
+        schema.maximums = info["maximums"]
+        schema.row_count = info["row_count"]
+        return schema
+
+
+class SampleAggregator(object):
+    '''
+    Keeps per-material running statistics over raw sample rows, keyed on one column.
+    Numeric columns hold count, mean and M2 (sum of squared deviations) so that partial results
+    can be merged exactly, every column keeps the first sample seen for each material.
+    Memory is bounded by the number of materials, not by the number of sample rows.
+    '''
+
+    def __init__(self, key: str, columns: List[str]):
+        self.key = key
+        self.columns = list(columns)
+        self.schema = DatasetSchema(self.columns, key)
+        self.count = pd.DataFrame(dtype=float)
+        self.mean = pd.DataFrame(dtype=float)
+        self.m2 = pd.DataFrame(dtype=float)
+        self.first = pd.DataFrame(columns=self.columns, dtype=object)
+        self.sample_count = 0
+
+    @property
+    def numeric_columns(self):
+        return self.schema.numericColumns()
+
+    @property
+    def descriptive_columns(self):
+        return self.schema.descriptiveColumns()
+
+    @property
+    def stat_columns(self):
+        # Integer columns keep statistics too, they are averaged once a later sample turns them into floats.
+        # The key is the index of every frame, so never aggregate it as a feature.
+        return [column for column in self.columns if self.schema.isParsedAsNumber(column) and column != self.key]
+
+    def update(self, samples: pd.DataFrame):
+        '''
+        Fold a chunk of raw sample rows into the running statistics.
+        '''
+        self.schema.update(samples)
+        samples = samples[samples[self.key].notna()]
+        if len(samples) == 0:
+            return
+        self.sample_count += len(samples)
+        grouped = samples[self.stat_columns].groupby(samples[self.key].values, sort=False)
+        count = grouped.count().astype(float)
+        mean = grouped.mean()
+        m2 = (grouped.var(ddof=0) * count).fillna(0.)
+        self.merge(count, mean, m2, self.firstRows(samples))
+
+    def merge(self, count: pd.DataFrame, mean: pd.DataFrame, m2: pd.DataFrame, first: pd.DataFrame):
+        '''
+        Merge partial statistics of another sample set with the pooled (Chan et al.) update.
+        '''
+        columns = self.stat_columns
+        count = count.reindex(columns=columns, fill_value=0.)
+        mean = mean.reindex(columns=columns)
+        m2 = m2.reindex(columns=columns, fill_value=0.)
+        if len(self.count) == 0:
+            self.count, self.mean, self.m2 = count, mean, m2
+        else:
+            index = self.count.index.union(count.index, sort=False)
+            count_a = self.count.reindex(index=index, columns=columns, fill_value=0.)
+            count_b = count.reindex(index, fill_value=0.)
+            mean_a = self.mean.reindex(index=index, columns=columns).fillna(0.)
+            mean_b = mean.reindex(index).fillna(0.)
+            total = count_a + count_b
+            with np.errstate(divide="ignore", invalid="ignore"):
+                delta = mean_b - mean_a
+                self.mean = (mean_a * count_a + mean_b * count_b) / total
+                self.m2 = (self.m2.reindex(index=index, columns=columns, fill_value=0.)
+                           + m2.reindex(index, fill_value=0.)
+                           + delta ** 2 * count_a * count_b / total).fillna(0.)
+            self.count = total
+        # Only materials seen for the first time contribute their descriptive features.
+        first = first[~first.index.isin(self.first.index)]
+        self.first = first if len(self.first) == 0 else pd.concat([self.first, first])
+
+    def mergeAggregator(self, other: "SampleAggregator"):
+        '''
+        Pool the statistics of another aggregator, e.g. of another file of the same dataset.
+        '''
+        self.schema.merge(other.schema)
+        self.columns = self.schema.columns
+        self.sample_count += other.sample_count
+        self.merge(other.count, other.mean, other.m2, other.first.reindex(columns=self.columns))
+
+    def firstRows(self, samples: pd.DataFrame):
+        first_rows = samples.loc[~samples[self.key].duplicated(), self.columns]
+        first_rows.index = samples.loc[first_rows.index, self.key].values
+        return first_rows
+
+    def variance(self):
+        '''
+        Sample variance per material and numeric column, NaN for fewer than two samples.
+        '''
+        with np.errstate(divide="ignore", invalid="ignore"):
+            return (self.m2 / (self.count - 1.)).where(self.count > 1.)
+
+    def table(self, keys=None):
+        '''
+        Emit one row per material: numeric means followed by the first-sample descriptive columns, sorted by key.
+        With `keys` only the rows of those materials are emitted.
+        '''
+        first = self.first if keys is None else self.first.reindex(pd.Index(keys).unique())
+        if not first.index.is_monotonic_increasing:
+            first = first.sort_index()
+        numeric_columns = self.numeric_columns
+        means = self.mean.reindex(index=first.index, columns=numeric_columns)
+        if self.key in numeric_columns:
+            means[self.key] = first.index.values
+        df = pd.concat([means, first[self.descriptive_columns]], axis=1)
+        return df.reset_index(drop=True)
+
+
+def readSampleChunks(filename: str, chunksize: int, progress: Callable[[int, int], None] = None,
+                     stop_event: threading.Event = None):
+    '''
+    Yield the raw sample rows of a CSV file in frames of at most `chunksize` rows.
+    `progress(read_bytes, total_bytes)` is called after every chunk, LoadCancelled is raised
+    before the next chunk once `stop_event` is set.
+    '''
+    total = os.path.getsize(filename)
+    with open(filename, "rb") as f:
+        for chunk in pd.read_csv(f, chunksize=chunksize):
+            if stop_event is not None and stop_event.is_set():
+                raise LoadCancelled()
+            yield chunk
+            if progress:
+                progress(min(f.tell(), total), total)
+    if progress:
+        progress(total, total)
+
+
+def readAppendedSamples(filename: str, offset: int, columns: List[str], parsed_tail: bytes = b""):
+    '''
+    Parse the complete lines appended to a CSV file after byte `offset`.
+    Return the new samples and the offset to continue from, a trailing partial line is left for later.
+    `parsed_tail` is the unterminated last line the file was loaded with, it is skipped once it is
+    terminated unchanged, see completeLinesEnd.
+    '''
+    with open(filename, "rb") as f:
+        f.seek(offset)
+        data = f.read()
+    end = data.rfind(b"\n") + 1
+    start = 0
+    if parsed_tail and end:
+        first_line = data[:data.find(b"\n") + 1]
+        if first_line.rstrip(b"\r\n") == parsed_tail:
+            start = len(first_line)
+    if end == 0 or not data[start:end].strip():
+        return None, offset + end
+    samples = pd.read_csv(io.BytesIO(data[start:end]), header=None, names=columns)
+    return samples, offset + end
+
+
+def completeLinesEnd(filename: str):
+    '''
+    Offset just past the last newline of a file and the bytes of the unterminated line after it.
+    '''
+    with open(filename, "rb") as f:
+        end = f.seek(0, os.SEEK_END)
+        position = end
+        tail = b""
+        while position > 0:
+            step = min(TAIL_BLOCK_BYTES, position)
+            position -= step
+            f.seek(position)
+            tail = f.read(step) + tail
+            newline = tail.rfind(b"\n")
+            if newline >= 0:
+                return position + newline + 1, tail[newline + 1:]
+    return 0, tail
+
+
+def aggregateFile(filename: str, chunksize: int = None, progress: Callable[[int, int], None] = None,
+                  stop_event: threading.Event = None):
+    '''
+    Aggregate a raw sample CSV with the first column as material key.
+    Without a `chunksize`, files above STREAMING_THRESHOLD_BYTES are streamed automatically.
+    With a `stop_event` every file is streamed, so setting it cancels the load at the next chunk.
+    '''
+    if chunksize is None and (stop_event is not None or os.path.getsize(filename) > STREAMING_THRESHOLD_BYTES):
+        chunksize = DEFAULT_CHUNK_ROWS
+    if chunksize:
+        chunks = readSampleChunks(filename, chunksize, progress, stop_event)
+    else:
+        chunks = [pd.read_csv(filename)]
+    aggregator = None
+    for chunk in chunks:
+        if aggregator is None:
+            aggregator = SampleAggregator(chunk.columns[0], chunk.columns)
+        aggregator.update(chunk)
+    if not chunksize and progress:
+        size = os.path.getsize(filename)
+        progress(size, size)
+    return aggregator
+
+
+def listSources(source: str):
+    '''
+    The CSV files of a source: a directory, a glob pattern or a single file.
+    '''
+    if os.path.isdir(source):
+        return sorted(glob.glob(os.path.join(source, "*.csv")))
+    if glob.has_magic(source):
+        return sorted(glob.glob(source))
+    return [source]
+
+
+def referenceKey(keys: List[str]):
+    '''
+    The key column the files of a dataset are merged on: EXPECTED_KEY_COLUMN if any file has it,
+    otherwise the key of most files, the earliest on a tie. None without keys.
+    '''
+    if EXPECTED_KEY_COLUMN in keys:
+        return EXPECTED_KEY_COLUMN
+    return max(keys, key=keys.count) if keys else None
+
+
+def aggregateFiles(filenames: List[str], chunksize: int = None, progress: Callable[[int, int], None] = None,
+                   cache=None, max_workers: int = None, stop_event: threading.Event = None):
+    '''
+    Aggregate many CSV files in a process pool and pool the per-material statistics.
+    Return the merged SampleAggregator (None if no file could be read) and a dict of
+    filename -> error message for the files which failed, these do not abort the load.
+    Once `stop_event` is set, the queued files are dropped and LoadCancelled is raised without
+    waiting for the files being read.
+    '''
+    sizes = {}
+    failures = {}
+    partials = {}
+    for filename in filenames:
+        try:
+            sizes[filename] = os.path.getsize(filename)
+            partials[filename] = cache.load(filename) if cache else None
+        except OSError as error:
+            failures[filename] = str(error)
+    total = sum(sizes.values())
+    done = sum(sizes[filename] for filename, partial in partials.items() if partial is not None)
+    pending = [filename for filename, partial in partials.items() if partial is None]
+    if pending:
+        # Forking the threaded UI process (the loader runs on a worker thread) can deadlock the children, so spawn them.
+        pool = ProcessPoolExecutor(max_workers=max_workers, mp_context=multiprocessing.get_context("spawn"))
+        futures = {pool.submit(aggregateFile, filename, chunksize): filename for filename in pending}
+        try:
+            remaining = set(futures)
+            while remaining:
+                finished, remaining = wait(remaining, timeout=CANCEL_POLL_SECONDS, return_when=FIRST_COMPLETED)
+                if stop_event is not None and stop_event.is_set():
+                    raise LoadCancelled()
+                for future in finished:
+                    filename = futures[future]
+                    try:
+                        partials[filename] = future.result()
+                        if cache:
+                            cache.store(filename, partials[filename])
+                    except Exception as error:
+                        failures[filename] = "%s: %s" % (type(error).__name__, error)
+                    done += sizes[filename]
+                    if progress:
+                        progress(done, total)
+        except BaseException:
+            # Cancelled or failed: drop the queued files, the workers cannot be interrupted and finish on their own.
+            for future in futures:
+                future.cancel()
+            pool.shutdown(wait=False)
+            raise
+        pool.shutdown()
+    elif progress:
+        progress(total, total)
+    readable = [filename for filename in filenames if partials.get(filename) is not None and filename not in failures]
+    key = referenceKey([partials[filename].key for filename in readable])
+    aggregator = None
+    # Merge in file order, so the first sample of a material always comes from the same file.
+    for filename in readable:
+        partial = partials[filename]
+        if partial.key != key:
+            failures[filename] = "Key column '%s' does not match '%s'." % (partial.key, key)
+            continue
+        if aggregator is None:
+            aggregator = partial
+            continue
+        try:
+            aggregator.mergeAggregator(partial)
+        except ValueError as error:
+            failures[filename] = str(error)
+    return aggregator, failures
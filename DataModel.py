@@ -1,117 +1,334 @@
 # -*- coding:utf-8 -*-
-from ast import Num
-from unicodedata import numeric
-from numpy import float64
+import os
+import re
+import threading
+from collections.abc import Mapping
+from typing import Callable, List
+
+import numpy as np
 import pandas as pd
-from typing import List
 
+from DataCache import DataCache
+from DataIngestion import aggregateFile, aggregateFiles, completeLinesEnd, listSources, readAppendedSamples
+from PropertyExpression import ExpressionError, PropertyCache, compileExpression
 
-class MaterialItem(object):
+
+# Columns with a dedicated slot in MaterialItem, everything else is a feature.
+ITEM_COLUMNS = ["Name", "Color_R", "Color_G", "Color_B", "Type", "rotation"]
+
+
+class MaterialTable(object):
     """
-    Use it to describe your Material
+    Struct-of-arrays storage of the aggregated materials: one contiguous NumPy array per column
+    plus a name and family index. Rows are accessed through lightweight MaterialItem views.
     """
 
-    def __init__(self, data: pd.Series):
-        self.label = data["Name"]
-        self.color_r = int(data["Color_R"])
-        self.color_g = int(data["Color_G"])
-        self.color_b = int(data["Color_B"])
-        self.family = data["Type"]
-        if "rotation" in data.keys():
-            self.rotation = data["rotation"]
+    def __init__(self, df: pd.DataFrame):
+        # An empty model has no columns at all.
+        df = df.reindex(columns=df.columns.union(ITEM_COLUMNS[:-1], sort=False))
+        self.labels = df["Name"].values.astype(object)
+        self.families = df["Type"].values.astype(object)
+        self.colors = np.ascontiguousarray(df[["Color_R", "Color_G", "Color_B"]].values.astype(np.int32))
+        if "rotation" in df.columns:
+            self.rotations = np.ascontiguousarray(df["rotation"].values, dtype=np.float64)
         else:
-            self.rotation = 0.0
-        # All other features of the material are stored in a dict allowing for flexible extension.
+            self.rotations = np.zeros(len(df))
+        # All other features of the materials are stored by column allowing for flexible extension.
         self.features = {}
-        for feature in data.keys():
-            if feature in ["Name", "Color_R", "Color_G", "Color_B", "Type", "rotation"]:
+        for column in df.columns:
+            if column in ITEM_COLUMNS:
                 continue
-            self.features[feature] = data[feature]
+            values = df[column].values
+            if values.dtype == object:
+                try:
+                    values = values.astype(np.float64)
+                except (TypeError, ValueError):
+                    pass
+            self.features[column] = np.ascontiguousarray(values)
+        self.rowByName = {label: row for row, label in enumerate(self.labels)}
+        self.familyCodes, self.familyNames = pd.factorize(self.families)
+        self._items = None
+
+    def __len__(self):
+        return len(self.labels)
+
+    def __iter__(self):
+        return iter(self.items().values())
+
+    def row(self, row: int):
+        return MaterialItem(self, row)
+
+    def items(self):
+        '''
+        Name -> MaterialItem view of every row, built once per table.
+        '''
+        if self._items is None:
+            self._items = {label: MaterialItem(self, row) for row, label in enumerate(self.labels)}
+        return self._items
+
+
+class MaterialFeatures(Mapping):
+    """
+    Read-only dict-like access to the feature columns of one table row.
+    """
+    __slots__ = ("table", "row")
+
+    def __init__(self, table: MaterialTable, row: int):
+        self.table = table
+        self.row = row
+
+    def __getitem__(self, feature: str):
+        return self.table.features[feature][self.row]
+
+    def __iter__(self):
+        return iter(self.table.features)
+
+    def __len__(self):
+        return len(self.table.features)
+
+
+class MaterialItem(object):
+    """
+    Use it to describe your Material. It is a view of one MaterialTable row.
+    """
+    __slots__ = ("table", "row")
+
+    def __init__(self, table: MaterialTable, row: int):
+        self.table = table
+        self.row = row
+
+    @property
+    def label(self):
+        return self.table.labels[self.row]
+
+    @property
+    def color_r(self):
+        return int(self.table.colors[self.row, 0])
+
+    @property
+    def color_g(self):
+        return int(self.table.colors[self.row, 1])
+
+    @property
+    def color_b(self):
+        return int(self.table.colors[self.row, 2])
+
+    @property
+    def family(self):
+        return self.table.families[self.row]
+
+    @property
+    def rotation(self):
+        return float(self.table.rotations[self.row])
+
+    @property
+    def features(self):
+        return MaterialFeatures(self.table, self.row)
+
 
 class AshbyModel(object):
-    def __init__(self, filename: str):
+    def __init__(self, filename: str, chunksize: int = None, progress: Callable[[int, int], None] = None,
+                 cache: DataCache = None, stop_event: threading.Event = None):
+        '''
+        `filename` is a CSV file, or a directory or glob pattern of CSV files sharing the same key column.
+        `chunksize` streams the CSV in frames of that many rows, `progress(read_bytes, total_bytes)`
+        reports the ingestion progress. Large files are streamed even without a chunksize.
+        With a `cache`, unchanged files are loaded from the aggregated on-disk copy.
+        Setting `stop_event` from another thread cancels the load with DataIngestion.LoadCancelled.
+        '''
+        self.chunksize = chunksize
+        self.progress = progress
+        self.cache = cache
+        self.stopEvent = stop_event
+        # Running per-material statistics of the raw samples, see DataIngestion.SampleAggregator.
+        self.aggregator = None
+        # Source file -> error message of the files which could not be loaded.
+        self.loadErrors = {}
+        # Column roles, dtypes, null counts and ranges of the raw samples, see DataIngestion.DatasetSchema.
+        self.schema = None
+        self.table = None
+        self.columnIndexes = {}
+        self.nameIndex = {}
+        self.familyIndex = {}
+        # Memoized derived properties, dropped by dataChanged.
+        self.propertyCache = PropertyCache()
+        # Bumped on every change of self.data so derived structures know when to rebuild.
+        self.dataVersion = 0
+        self.filename = filename
+        self.sourceOffset = None
+        self.sourceTail = b""
         self.data = self.initFromData(filename)
+        self.dataChanged()
         print(self.data)
 
     def getMaterialTypes(self):
-        if "Type" not in self.data:
-            return []
-        return list(self.data["Type"].unique())
+        return list(self.familyIndex.keys())
 
     def getItemByType(self, typestr: str):
         return self.getItemsByFamily("Type", typestr)
 
     def initFromData(self, filename: str):
         df = pd.DataFrame()
-        if filename:
-            temp_df = pd.read_csv(filename)
-            # Find the numerical and string columns.
-            string_columns = []
-            numeric_columns = []
-            for column in temp_df.columns:
-                if isinstance(temp_df[column][0], float):
-                    numeric_columns.append(column)
-                else:
-                    string_columns.append(column)
+        if filename and not os.path.isfile(filename):
+            # A directory or glob pattern of per-supplier files, parsed in parallel.
+            self.aggregator, self.loadErrors = aggregateFiles(listSources(filename), self.chunksize,
+                                                              self.progress, self.cache, stop_event=self.stopEvent)
+            for source, error in self.loadErrors.items():
+                print("Failed to load %s: %s" % (source, error))
+        elif filename:
+            # Everything before this offset is aggregated, and so is an unterminated last line, see refresh.
+            self.sourceOffset, self.sourceTail = completeLinesEnd(filename)
             # Use the first column to group different samples from the same material.
-            for name, sub_df in temp_df.groupby(temp_df.columns[0]):
-                # Calculate the mean among all numeric columns.
-                avg_series = sub_df.loc[:, numeric_columns].mean(axis=0, skipna=True)
-                # Take the first row to capture descriptive features in string columns.
-                avg_series = avg_series.append(sub_df[string_columns].iloc[0].squeeze())
-                df = df.append(avg_series.to_frame().T)
+            self.aggregator = self.cache.load(filename) if self.cache else None
+            if self.aggregator is None:
+                self.aggregator = aggregateFile(filename, self.chunksize, self.progress, self.stopEvent)
+                if self.cache:
+                    self.cache.store(filename, self.aggregator)
+        if self.aggregator is not None:
+            self.schema = self.aggregator.schema
+            df = self.aggregator.table()
 
         # remove na for compatibility now!
         df.dropna(inplace=True)
         return df
 
-    # to let the user select family catagory, copied from initFromData
-    def getStringColumn(self, filename: str):
-        if filename:
-            temp_df = pd.read_csv(filename)
-            # Find the string columns.
-            string_data = temp_df.select_dtypes(include = object)
-    #TODO(guaishow): is the text/string things in Pandas called object?
-            string_columns = string_data.columns
-        return string_columns
-
-    def getNumericColumns(self, filename: str):
-        if filename:
-            temp_df = pd.read_csv(filename)
-            numeric_data = temp_df.select_dtypes(include = float)
-            numeric_columns = numeric_data.columns
-        return numeric_columns
-
-    #TODO(team): handle more complex semantic expression.
+    def refresh(self):
+        '''
+        Fold the sample rows appended to the source CSV since the last load into the running statistics.
+        Only the affected materials are re-aggregated. Return their names, None if the file was
+        rewritten instead of appended to, the model is left as is and the file has to be loaded again.
+        '''
+        if self.sourceOffset is None or not os.path.isfile(self.filename):
+            return []
+        if os.path.getsize(self.filename) < self.sourceOffset + len(self.sourceTail):
+            if self.cache:
+                self.cache.invalidate(self.filename)
+            return None
+        offset = self.sourceOffset
+        samples, self.sourceOffset = readAppendedSamples(self.filename, offset, self.aggregator.columns,
+                                                         self.sourceTail)
+        if self.sourceOffset > offset:
+            # The line after the old offset is terminated now, the tail was skipped or parsed with it.
+            self.sourceTail = b""
+        if samples is None:
+            return []
+        self.aggregator.update(samples)
+        changed = list(samples[self.aggregator.key].dropna().unique())
+        rows = self.aggregator.table(changed)
+        rows.dropna(inplace=True)
+        data = self.data[~self.data[self.aggregator.key].isin(changed)]
+        # dropna leaves gaps in the index, so new labels taken from len(self.data) could collide with existing ones.
+        self.data = pd.concat([data, rows], ignore_index=True)
+        if not self.data[self.aggregator.key].is_monotonic_increasing:
+            self.data.sort_values(self.aggregator.key, inplace=True)
+        self.dataChanged()
+        return changed
+
+    # to let the user select family catagory
+    def getStringColumn(self):
+        if self.schema is None:
+            return []
+        return self.schema.stringColumns()
+
+    def getNumericColumns(self):
+        if self.schema is None:
+            return []
+        return self.schema.numericColumns()
+
     def addProperty(self, new_column_info: List):
         '''
         Manipulate to calculate additional terms from the data. Return the name of the new term.
         New column info is descried as [numerator, order_of_numerator, denominator, order_of_denominator].
+        The term is an expression evaluated on demand, see evaluateProperty, nothing is added to self.data.
         '''
-        new_str = new_column_info[0] + '^' + str(new_column_info[1]) + '/' + new_column_info[2] + '^' + str(new_column_info[3])
-        if new_str not in self.data.columns:
-            self.data[new_str] = (self.data[new_column_info[0]] ** new_column_info[1] / self.data[new_column_info[2]] ** new_column_info[3])
+        names = [name if re.match(r"^[A-Za-z_][A-Za-z0-9_.]*$", name) else "[%s]" % name
+                 for name in (new_column_info[0], new_column_info[2])]
+        new_str = names[0] + '^' + str(new_column_info[1]) + '/' + names[1] + '^' + str(new_column_info[3])
+        self.evaluateProperty(new_str)
         return new_str
 
+    def evaluateProperty(self, expression: str):
+        '''
+        Values of a derived property such as `Modulus^(1/2)/Density` for every row of the table.
+        Expressions are parsed once and their results memoized until a source column changes.
+        '''
+        compiled = compileExpression(expression).bind(self.resolveColumnName)
+        return self.propertyCache.evaluate(compiled, self.getTable().features.__getitem__)
+
+    def resolveColumnName(self, name: str):
+        # Allow the short names offered by the Axes dialog, e.g. "Modulus" for "Modulus_mean".
+        features = self.getTable().features
+        for column in (name, name + "_mean"):
+            if column in features:
+                return column
+        raise ExpressionError("Unknown column '%s'." % name)
+
+    def getColumnValues(self, name: str):
+        '''
+        Values of a feature column, or of a derived property expression.
+        '''
+        features = self.getTable().features
+        if name in features:
+            return features[name]
+        return self.evaluateProperty(name)
+
     @staticmethod
     def convertToItem(df):
-        items = {}
-        for idx, row in df.iterrows():
-            items[row.Name] = MaterialItem(row)
-        return items
+        return dict(MaterialTable(df).items())
+
+    def getTable(self):
+        '''
+        The MaterialTable of the current data, rebuilt only after the data changed.
+        '''
+        if self.table is None:
+            self.table = MaterialTable(self.data)
+        return self.table
+
+    def dataChanged(self):
+        '''
+        Call after every mutation of self.data, rebuilds the table and the lookup indexes.
+        '''
+        self.dataVersion += 1
+        self.table = MaterialTable(self.data)
+        self.propertyCache.clear()
+        self.columnIndexes = {}
+        # name -> row position and family -> row positions, shared with the controller and tree view.
+        self.nameIndex = self.table.rowByName
+        self.familyIndex = self.getColumnIndex("Type")
+
+    def getColumnIndex(self, column: str):
+        '''
+        Value -> row positions of a column in order of first appearance, built once per data version.
+        '''
+        if column not in self.columnIndexes:
+            if column == "Type":
+                codes, values = self.table.familyCodes, self.table.familyNames
+            elif column in self.data:
+                codes, values = pd.factorize(self.data[column].values)
+            else:
+                codes, values = np.empty(0, dtype=np.int64), []
+            order = np.argsort(codes, kind="stable")
+            bounds = np.cumsum(np.bincount(codes[codes >= 0], minlength=len(values)))
+            groups = np.split(order[len(codes) - bounds[-1]:] if len(values) else order, bounds[:-1])
+            self.columnIndexes[column] = dict(zip(values, groups))
+        return self.columnIndexes[column]
 
     def getAllItems(self):
-        return self.convertToItem(self.data)
+        return self.getTable().items()
+
+    def getItemsByRows(self, rows):
+        table = self.getTable()
+        return {table.labels[row]: table.row(row) for row in rows}
 
     def getItem(self, label):
-        return self.convertToItem(self.data[self.data.Name == label])
+        row = self.nameIndex.get(label)
+        return {} if row is None else self.getItemsByRows([row])
 
     def getItemsByFamily(self, column: str, label: str):
-        return self.convertToItem(self.data[self.data[column] == label])
+        return self.getItemsByRows(self.getColumnIndex(column).get(label, []))
 
     def provideFamilyCandidateByColumn(self, column_name: str):
-        candidate = self.data[column_name].drop_duplicates()
-        return candidate.values
+        return np.array(list(self.getColumnIndex(column_name).keys()), dtype=object)
 
     def getColumns(self):
         return self.data.columns
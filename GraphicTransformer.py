@@ -1,11 +1,19 @@
+import hashlib
+from functools import partial
 from math import log10
 from typing import List
 
+import numpy as np
 from PySide2.QtCore import QPointF, QRectF
-from PySide2.QtGui import QPolygonF
 
-from AlgorithmUtils import ellipseHull, simpleEllipse
-from DataModel import MaterialItem
+from AlgorithmUtils import LRUCache, computeEllipseHull, ellipseArrays, simpleEllipse
+from DataModel import AshbyModel, MaterialItem
+from QtGeometry import polygonFromArray
+
+# Columns describing the ellipse of a material: x, width, y, height.
+DEFAULT_AXIS_COLUMNS = ("Modulus_mean", "Modulus_sd", "Strength_mean", "Strength_sd")
+GEOMETRY_CACHE_SIZE = 8
+HULL_CACHE_SIZE = 128
 
 class GraphicConfig():
     '''
@@ -16,9 +24,15 @@ class GraphicConfig():
         self.expend_ratio = 2.
         self.hull_sampling_step = 200
         self.log_scale = True
+        # Pixels per scene unit the hulls are built for. Without it every ellipse
+        # takes `hull_sampling_step` samples and hulls are not simplified.
+        self.view_scale = None
+        # Largest on-screen deviation (in pixels) of the sampled and the simplified hull outline.
+        self.hull_max_error_px = 0.25
+        self.hull_simplify_px = 0.5
 
     def updateConfig(self, expend_ratio: float=None,
-                      hull_sampling_step: int=None, log_scale: bool=None):
+                      hull_sampling_step: int=None, log_scale: bool=None, view_scale: float=None):
         # Updates can be optional. Only update the config values which are explicitly passed in.
         if expend_ratio:
             self.expend_ratio = expend_ratio
@@ -26,6 +40,27 @@ class GraphicConfig():
             self.hull_sampling_step = hull_sampling_step
         if log_scale is not None:
             self.log_scale = log_scale
+        if view_scale:
+            self.view_scale = view_scale
+
+    def key(self):
+        return (self.expend_ratio, self.hull_sampling_step, self.log_scale,
+                self.view_scale, self.hull_max_error_px, self.hull_simplify_px)
+
+
+class BatchGeometry():
+    '''
+    Plot geometry of all rows of a MaterialTable as arrays: `rects` holds (upper_left_x, upper_left_y,
+    width, height), `centers` holds (x, y) and `rotations` the angle in degrees.
+    '''
+
+    def __init__(self, rects: np.ndarray, centers: np.ndarray, rotations: np.ndarray):
+        self.rects = rects
+        self.centers = centers
+        self.rotations = rotations
+
+    def __len__(self):
+        return len(self.rects)
 
 
 class GraphicTransformer():
@@ -34,8 +69,43 @@ class GraphicTransformer():
     Note the final Qt objects have negative y values to fit the y-axis style in the plot.
     '''
 
-    def __init__(self, config: GraphicConfig):
+    def __init__(self, config: GraphicConfig, axis_columns=DEFAULT_AXIS_COLUMNS):
         self.config = config
+        self.axis_columns = tuple(axis_columns)
+        self.geometryCache = LRUCache(GEOMETRY_CACHE_SIZE)
+        # Hull vertices keyed by hullKey().
+        self.hullCache = LRUCache(HULL_CACHE_SIZE)
+
+    def transformAll(self, model: AshbyModel):
+        '''
+        Transform every material of the model at once, rows follow model.getTable().
+        Results are cached per (log scale, axis columns, data version).
+        '''
+        key = (id(model), model.dataVersion, self.config.log_scale, self.axis_columns)
+        geometry = self.geometryCache.get(key)
+        if geometry is None:
+            x, w, y, h = (np.asarray(model.getColumnValues(column), dtype=np.float64) for column in self.axis_columns)
+            geometry = self.transformArrays(x, w, y, h, model.getTable().rotations)
+            self.geometryCache.put(key, geometry)
+        return geometry
+
+    def transformArrays(self, x: np.ndarray, w: np.ndarray, y: np.ndarray, h: np.ndarray, rotations: np.ndarray):
+        '''
+        Vectorized convertMatToSimpleEllipse.
+        '''
+        upper_left_x = x - w / 2.
+        upper_left_y = - y - h / 2.
+        width = w
+        height = h
+        if self.config.log_scale:
+            with np.errstate(divide="ignore", invalid="ignore"):
+                width = np.log10(upper_left_x + width) - np.log10(upper_left_x)
+                height = np.log10(-upper_left_y) - np.log10(-(upper_left_y - height))
+                upper_left_x = np.log10(upper_left_x)
+                upper_left_y = -np.log10(-upper_left_y)
+        rects = np.stack((upper_left_x, upper_left_y, width, height), axis=1)
+        centers = np.stack((upper_left_x + width / 2., upper_left_y + height / 2.), axis=1)
+        return BatchGeometry(rects, centers, np.asarray(rotations, dtype=np.float64))
 
     def matToSquare(self, mat_item: MaterialItem):
         elps = self.convertMatToSimpleEllipse(mat_item)
@@ -53,21 +123,66 @@ class GraphicTransformer():
         elps = self.convertMatToSimpleEllipse(mat_item)
         return elps.rotation
 
-    def getEllipseHull(self, items: List[MaterialItem]):
-        hull_v = ellipseHull([self.convertMatToSimpleEllipse(item) for item in items],
-                           self.config.expend_ratio,
-                           self.config.hull_sampling_step)
-        return QPolygonF(list(map(QPointF, *hull_v.T)))
+    def getEllipseHull(self, items: List[MaterialItem], model: AshbyModel = None):
+        key, job = self.prepareHull(items, model)
+        hull_v = self.cachedHull(key)
+        if hull_v is None:
+            hull_v = job()
+            self.storeHull(key, hull_v)
+        return self.hullPolygon(hull_v)
+
+    def prepareHull(self, items: List[MaterialItem], model: AshbyModel = None, rows: np.ndarray = None):
+        '''
+        Snapshot the geometry and config of a hull into its cache key and a callable returning its vertices.
+        The callable shares no state with the transformer, so it can run off the UI thread.
+        `rows` may give the sorted rows of the items in model.getTable(), saving a pass over the items.
+        '''
+        if model is not None and (rows is not None or all(item.table is model.table for item in items)):
+            geometry = self.transformAll(model)
+            # Sorted rows make the key depend on the member set only, not on the order of the items.
+            if rows is None:
+                rows = np.sort(np.fromiter((item.row for item in items), dtype=np.intp, count=len(items)))
+            arrays = geometry.centers[rows], geometry.rects[rows, 2:], geometry.rotations[rows]
+        else:
+            arrays = ellipseArrays([self.convertMatToSimpleEllipse(item) for item in items])
+        key = self.hullKey(arrays)
+        view_scale = self.config.view_scale
+        if view_scale:
+            # Sample densely enough for the current zoom only, then drop the vertices nobody can see.
+            return key, partial(computeEllipseHull, *arrays, self.config.expend_ratio, self.config.hull_sampling_step,
+                                self.config.hull_max_error_px / view_scale, self.config.hull_simplify_px / view_scale)
+        return key, partial(computeEllipseHull, *arrays, self.config.expend_ratio, self.config.hull_sampling_step)
+
+    def hullKey(self, arrays):
+        '''
+        Fingerprint of the member geometry together with every setting the hull depends on.
+        Unchanged families keep their key across data refreshes.
+        '''
+        digest = hashlib.blake2b(digest_size=16)
+        for array in arrays:
+            digest.update(np.ascontiguousarray(array, dtype=np.float64).tobytes())
+        return digest.hexdigest(), len(arrays[0]), self.config.key(), self.axis_columns
+
+    def cachedHull(self, key):
+        return self.hullCache.get(key)
+
+    def storeHull(self, key, hull_v: np.ndarray):
+        # Entries are shared by every drawing of the hull, so keep them immutable.
+        hull_v.setflags(write=False)
+        self.hullCache.put(key, hull_v)
+
+    @staticmethod
+    def hullPolygon(hull_v: np.ndarray):
+        return polygonFromArray(hull_v)
 
     #
     # Private
     #
-    def convertMatToSimpleEllipse(self, mat_item: MaterialItem,
-                                  x: str = "Modulus_mean", w: str = "Modulus_sd",
-                                  y: str = "Strength_mean", h: str = "Strength_sd"):
+    def convertMatToSimpleEllipse(self, mat_item: MaterialItem):
         '''
         Convert an material item to a pure geometry object.
         '''
+        x, w, y, h = self.axis_columns
         upper_left_x = mat_item.features[x] - mat_item.features[w] / 2.
         # Specific handling of y-coor (is a negative value) because we actually mark
         # the neg-y area on the plot as pos-y for visualization purpose.
@@ -1,26 +1,104 @@
 # -*- coding:utf-8 -*-
+from time import perf_counter
 from typing import List
 
-from PySide2.QtCore import QPointF, QRectF
-from PySide2.QtGui import QBrush, QPen, QColor, QFont, QPolygonF
+import numpy as np
 
+from PySide2.QtCore import QPointF, QRectF, QTimer
+from PySide2.QtGui import QBrush, QPen, QColor, QPolygonF
+from PySide2.QtWidgets import QGraphicsItem
+
+from BackgroundTasks import BackgroundTasks
 from DataModel import AshbyModel, MaterialItem
 from GraphicTransformer import GraphicConfig, GraphicTransformer
+from View.DensityLayer import DensityLayer
+from View.LabelLayer import LabelLayer
+from View.MaterialLayer import MaterialLayer
+
+# Hulls are re-sampled for the new zoom once it changed by this factor (either way).
+HULL_REFINE_ZOOM_RATIO = 2.
+# Charts with more materials are populated in time slices, nearest to the viewport first.
+POPULATE_SYNC_LIMIT = 5000
+POPULATE_SLICE_SECONDS = 0.012
+POPULATE_MIN_BATCH = 512
+# Density modes: the heatmap replaces the ellipses automatically when too many are visible, or always, or never.
+DENSITY_AUTO = 0
+DENSITY_ON = 1
+DENSITY_OFF = 2
+# The auto mode shows the heatmap above DENSITY_ENTER_COUNT visible materials and the ellipses again
+# below DENSITY_EXIT_COUNT, the gap keeps it from flickering around one count.
+DENSITY_ENTER_COUNT = 20000
+DENSITY_EXIT_COUNT = 15000
+
+class HullGroup(list):
+    '''
+    The materials of one drawn hull, `key` is the family name or None for the hull of all materials.
+    `rows` are their sorted rows in `table`, when known.
+    '''
+
+    def __init__(self, items, key=None, rows=None, table=None):
+        super(HullGroup, self).__init__(items)
+        self.key = key
+        self.rows = rows
+        self.table = table
+
 
 class AshbyGraphicsController(object):
-    def __init__(self, window, filename: str):
+    def __init__(self, window, filename: str, model: AshbyModel = None):
         self.window = window
         self.view = window.ui.graphicsView
         self.scene = window.myScene
         self.tree = window.ui.treeView
         self.pen = QPen(QColor(0, 0, 0))
         self.pen.setWidth(0)
-        self.model = AshbyModel(filename)
+        # A model loaded in the background is handed in, otherwise the file is loaded right here.
+        self.model = model if model is not None else AshbyModel(filename, cache=window.dataCache)
+        # This controller replaces the window's current one, whose items and layers belong to the old dataset.
+        previous = getattr(window, "controller", None)
+        if previous is not None:
+            previous.clearScene()
+            previous.disconnectSignals()
         self.config = GraphicConfig()
+        self.config.updateConfig(view_scale=self.view.viewScale)
         self.transformer = GraphicTransformer(self.config)
-        # Store the semantic items which have been drawn on the plot, used when the config is updated.
-        self.semanticItems = []
-
+        # Scene items of the drawn materials and hulls, so a data refresh only redraws what changed.
+        self.ellipseItems = {}
+        self.hullItems = {}
+        # All material ellipses and labels are painted by two layer items, layerGeometry is the geometry they hold
+        # and layerTable the MaterialTable its rows belong to.
+        self.materialLayer = MaterialLayer()
+        self.labelLayer = LabelLayer()
+        self.labelLayer.setViewScale(self.view.viewScale)
+        self.layerGeometry = None
+        self.layerTable = None
+        # Heatmap of the drawn materials, shown instead of the material and label layers in density mode.
+        self.densityLayer = DensityLayer(self.materialLayer)
+        self.densityLayer.setVisible(False)
+        self.densityMode = DENSITY_AUTO
+        # The grid index and the density decision follow changed materials in a slice of their own.
+        self.densityTimer = QTimer()
+        self.densityTimer.setSingleShot(True)
+        self.densityTimer.setInterval(0)
+        self.densityTimer.timeout.connect(self.syncDensity)
+        # Hulls are computed in a thread pool, pendingHulls holds the groups still in flight.
+        self.hullTasks = BackgroundTasks()
+        self.hullTasks.finished.connect(self.onHullReady)
+        self.hullTasks.failed.connect(self.onHullFailed)
+        self.pendingHulls = {}
+        # Set by fitView, the view is fitted again once no hull is in flight.
+        self.fitPending = False
+        # Rows of layerTable still to be shown by the population timer and their distance to the viewport
+        # it was measured for, see populateSlice.
+        self.populateQueue = np.empty(0, dtype=np.intp)
+        self.populateDistances = np.empty(0)
+        self.populateViewport = None
+        self.populateTotal = 0
+        self.populateBatch = POPULATE_MIN_BATCH
+        # Scene rect of the drawn and queued materials, None until it is measured again.
+        self.populateBounds = None
+        self.populateTimer = QTimer()
+        self.populateTimer.setInterval(0)
+        self.populateTimer.timeout.connect(self.populateSlice)
         self.initTreeView()
         self.connectSignals()
 
@@ -29,29 +107,194 @@ class AshbyGraphicsController(object):
     #
     def updateConfig(self, expend_ratio: float=None, hull_sampling_step: int=None, log_scale: bool=None):
         self.config.updateConfig(expend_ratio, hull_sampling_step, log_scale)
-        self.transformer = GraphicTransformer(self.config)
         self.updateGraphicItems()
 
+    def onViewScaleChanged(self, view_scale: float):
+        '''
+        Re-samples the drawn hulls for the new zoom, small zoom steps keep the current outlines.
+        '''
+        self.labelLayer.setViewScale(view_scale)
+        ratio = view_scale / self.config.view_scale
+        if max(ratio, 1. / ratio) < HULL_REFINE_ZOOM_RATIO:
+            return
+        self.config.updateConfig(view_scale=view_scale)
+        groups = [group for group, _ in self.hullItems.values()] + self.cancelHulls()
+        for group in {id(group): group for group in groups}.values():
+            self.submitHull(group)
+
+    def fitView(self):
+        '''
+        Fits the view to the drawn items, and again once the hulls in flight are drawn.
+        '''
+        # The new zoom can re-sample the hulls, cached ones are redrawn before fitView returns.
+        self.fitPending = True
+        self.view.fitView()
+        self.fitWhenHullsDrawn()
+
     def clearScene(self):
         for item in self.view.graphicItems:
             self.scene.removeItem(item)
         # self.scene.clear()
-        self.view.graphicItems.clear()
-        self.semanticItems.clear()
+        self.view.clearGraphicItems()
+        self.cancelHulls()
+        self.fitPending = False
+        self.stopPopulation()
+        self.ellipseItems.clear()
+        self.hullItems.clear()
+        self.materialLayer.clear()
+        self.labelLayer.clear()
+        if self.labelLayer.scene() is not None:
+            self.scene.removeItem(self.labelLayer)
+        if self.densityLayer.scene() is not None:
+            self.scene.removeItem(self.densityLayer)
+        self.densityTimer.stop()
+        self.densityLayer.geometryChanged()
+        self.showDensity(False)
+
+    def onViewportChanged(self):
+        # While populating, the last slice decides.
+        if self.densityMode == DENSITY_AUTO and not self.isPopulating():
+            self.updateDensity()
+
+    def setDensityMode(self, mode: int, weighted: bool = None):
+        '''
+        DENSITY_AUTO, DENSITY_ON or DENSITY_OFF, `weighted` bins the materials by ellipse area instead of by count.
+        '''
+        self.densityMode = mode
+        if weighted is not None:
+            self.densityLayer.setWeighted(weighted)
+        self.updateDensity()
+
+    def isDensityShown(self):
+        return self.densityLayer.isVisible()
 
     def drawAllMaterialEclipses(self):
-        for name, info in self.model.getAllItems().items():
-            self.drawEllipse(info)
+        if self.model.getCount() > POPULATE_SYNC_LIMIT:
+            self.populateMaterials(np.arange(len(self.model.getTable().labels)))
+        else:
+            self.drawMaterials(self.model.getAllItems().values())
+
+    def populateMaterials(self, rows: np.ndarray):
+        '''
+        Shows the materials of the table rows batch by batch from a timer, so the view stays responsive.
+        Each slice shows the queued materials nearest to the current viewport, within a time budget.
+        '''
+        self.syncMaterialLayer()
+        drawn = self.materialLayer.drawn
+        rows = np.unique(np.asarray(rows, dtype=np.intp))
+        self.populateQueue = np.union1d(self.populateQueue, rows[~drawn[rows]])
+        self.populateViewport = None
+        self.populateBounds = None
+        self.populateTotal = len(self.populateQueue) + int(drawn.sum())
+        self.materialLayersChanged()
+        if len(self.populateQueue):
+            self.populateTimer.start()
+
+    def isPopulating(self):
+        return len(self.populateQueue) > 0
+
+    def populationProgress(self):
+        '''
+        (shown, total) materials of the population in progress or the last finished one.
+        '''
+        return self.populateTotal - len(self.populateQueue), self.populateTotal
+
+    def stopPopulation(self):
+        '''
+        Stops populating and returns the table rows which were still queued.
+        '''
+        self.populateTimer.stop()
+        queue = self.populateQueue
+        self.populateQueue = np.empty(0, dtype=np.intp)
+        self.populateDistances = np.empty(0)
+        return queue
+
+    def materialAt(self, point: QPointF):
+        '''
+        The drawn material under a scene point, None if there is none.
+        '''
+        if self.layerGeometry is None:
+            return None
+        row = self.materialLayer.rowAt(point)
+        return self.model.getTable().row(row) if row >= 0 else None
 
     def drawFamilyHull(self):
-        family_candidates = self.model.provideFamilyCandidateByColumn("Type")
-        for family in family_candidates:
-            items = self.model.getItemsByFamily("Type", family).values()
-            self.drawHull(list(items))
+        for family in self.model.familyIndex:
+            self.submitHull(self.hullGroup(family))
 
     def drawAllHull(self):
-        items = self.model.getAllItems().values()
-        self.drawHull(list(items))
+        self.submitHull(self.hullGroup(None))
+
+    def hullGroup(self, key):
+        '''
+        The current materials of a hull key, None if the family does not exist (anymore).
+        '''
+        table = self.model.getTable()
+        if key is None:
+            return HullGroup(self.model.getAllItems().values(), rows=np.arange(len(table.labels)), table=table)
+        if key not in self.model.familyIndex:
+            return None
+        rows = np.sort(self.model.familyIndex[key])
+        return HullGroup(self.model.getItemsByRows(rows).values(), key, rows, table)
+
+    def refreshData(self):
+        '''
+        Folds the rows appended to the CSV into the model and redraws only the changed materials
+        and the hulls of their families. Return False if the CSV was rewritten and has to be loaded again.
+        '''
+        changed = self.model.refresh()
+        if changed is None:
+            return False
+        if changed == []:
+            return True
+        items = self.model.getAllItems()
+        chart_drawn = bool(self.ellipseItems)
+        families = set()
+        stale = []
+        redraw = []
+        for name in changed:
+            was_drawn = name in self.ellipseItems
+            if was_drawn:
+                mat_item = self.ellipseItems.pop(name)
+                families.add(mat_item.family)
+            if name in items:
+                families.add(items[name].family)
+                if was_drawn or chart_drawn:
+                    redraw.append(items[name])
+        hull_keys = [key for key in self.hullItems if key is None or key in families]
+        # Hulls still in flight were sampled from the old data, queue them again.
+        hull_keys.extend(group.key for group in self.cancelHulls() if group.key not in hull_keys)
+        for key in hull_keys:
+            if key in self.hullItems:
+                stale.append(self.hullItems.pop(key)[1])
+        self.removeItems(stale)
+        if chart_drawn:
+            self.drawMaterials(redraw)
+        for key in hull_keys:
+            group = self.hullGroup(key)
+            if group:
+                self.submitHull(group)
+        self.initTreeView()
+        return True
+
+    def drawnState(self):
+        '''
+        Whether the materials are drawn and the keys of the drawn hulls, see restoreDrawnState.
+        '''
+        hull_keys = list(self.hullItems) + [group.key for group, _ in self.pendingHulls.values()]
+        return bool(self.ellipseItems) or self.isPopulating(), list(dict.fromkeys(hull_keys))
+
+    def restoreDrawnState(self, state):
+        '''
+        Draws what drawnState() reported for the controller of a previous load of the same data.
+        '''
+        chart_drawn, hull_keys = state
+        if chart_drawn:
+            self.drawAllMaterialEclipses()
+        for key in hull_keys:
+            group = self.hullGroup(key)
+            if group:
+                self.submitHull(group)
 
     def updateObjectsByAxis(self, new_column_info: List[List]):
         x_column_info = new_column_info[0]
@@ -61,8 +304,8 @@ class AshbyGraphicsController(object):
 
         #TODO(tienan): implement the addtional logic.
         #Adjust the transformer to allow the flexibility of different x,y selection.
-        print(x_column, x_column in self.model.getColumns())
-        print(y_column, y_column in self.model.getColumns())
+        print(x_column, self.model.getColumnValues(x_column))
+        print(y_column, self.model.getColumnValues(y_column))
 
     #
     # Private
@@ -70,44 +313,257 @@ class AshbyGraphicsController(object):
     def connectSignals(self):
         self.tree.OnSelectionChanged.connect(self.OnTreeSelectionChanged)
 
+    def disconnectSignals(self):
+        self.tree.OnSelectionChanged.disconnect(self.OnTreeSelectionChanged)
+
     def OnTreeSelectionChanged(self, selections):
-        # todo: make it do someing!
-        print(selections)
-        # anotherway to get
-        selections = self.tree.getSelections()
-        print(selections)
+        if self.layerGeometry is not None:
+            self.selectLabels(selections)
 
     def initTreeView(self):
         self.tree.clearModel()
-        mattypes = self.model.getMaterialTypes()
-        items = self.model.getAllItems()
-        self.tree.addFamilies(mattypes)  # not necessary at all
-        for item in items.values():
-            self.tree.addItem(item, item.family)
+        labels = self.model.getTable().labels
+        for family, rows in self.model.familyIndex.items():
+            self.tree.addFamilyItems(family, labels[rows])
 
     def drawEllipse(self, mat_item: MaterialItem):
-        brush = QBrush(QColor(mat_item.color_r, mat_item.color_g, mat_item.color_b, a=255))
-        elps = self.scene.addEllipse(self.transformer.matToSquare(mat_item), self.pen, brush)
-        elps.setRotation(self.transformer.matRotation(mat_item))
-
-        text = self.scene.addText(mat_item.label, QFont("Arial", 12, 2))
-        text.setPos(self.transformer.matCenterPoint(mat_item))
-        text.setRotation(self.transformer.matRotation(mat_item))
-        # Append semantic item info for re-draw.
-        # TODO(tienan): consider consolidate the two item caches together.
-        self.semanticItems.append(mat_item)
-        # Append graphic item info for view adjustment.
-        self.view.graphicItems.extend((elps, text))
+        self.drawMaterials([mat_item])
+
+    def drawMaterials(self, mat_items: List[MaterialItem]):
+        '''
+        Shows the ellipses and labels of the materials on the material and label layers.
+        '''
+        if not mat_items:
+            return
+        table = self.model.getTable()
+        self.syncMaterialLayer()
+        rows = []
+        for mat_item in mat_items:
+            row = table.rowByName.get(mat_item.label)
+            if row is None:
+                continue
+            self.ellipseItems[mat_item.label] = mat_item
+            rows.append(row)
+        self.materialLayer.showRows(rows)
+        self.labelLayer.showRows(rows)
+        self.materialLayersChanged()
+
+    def populateSlice(self):
+        if not self.isPopulating():
+            self.populateTimer.stop()
+            return
+        start = perf_counter()
+        state = self.view.viewportState()
+        if state.version != self.populateViewport:
+            # The view moved, measure again which materials are nearest.
+            self.populateViewport = state.version
+            self.populateDistances = self.viewportDistances(self.layerGeometry.centers[self.populateQueue], state.rect)
+        count = min(self.populateBatch, len(self.populateQueue))
+        if count < len(self.populateQueue):
+            picked = np.argpartition(self.populateDistances, count - 1)[:count]
+        else:
+            picked = np.arange(count)
+        picked = picked[np.argsort(self.populateDistances[picked], kind="stable")]
+        rows = self.populateQueue[picked]
+        remaining = np.ones(len(self.populateQueue), dtype=bool)
+        remaining[picked] = False
+        self.populateQueue = self.populateQueue[remaining]
+        self.populateDistances = self.populateDistances[remaining]
+        table = self.layerTable
+        self.drawMaterials([table.row(row) for row in rows.tolist()])
+        shown, total = self.populationProgress()
+        if self.isPopulating():
+            self.window.ui.statusbar.showMessage("Drawing materials ... %d of %d" % (shown, total))
+        else:
+            self.populateTimer.stop()
+            self.window.ui.statusbar.showMessage("Drew %d materials." % total)
+        # Size the next batch to the time budget.
+        elapsed = perf_counter() - start
+        if elapsed < POPULATE_SLICE_SECONDS / 2:
+            self.populateBatch *= 2
+        elif elapsed > POPULATE_SLICE_SECONDS:
+            self.populateBatch = max(POPULATE_MIN_BATCH, self.populateBatch // 2)
+
+    @staticmethod
+    def viewportDistances(centers: np.ndarray, rect: QRectF):
+        '''
+        Scene distance of each point to the rect, 0 inside it and inf for points which cannot be drawn.
+        '''
+        x, y = centers.T
+        dx = np.maximum(np.maximum(rect.left() - x, x - rect.right()), 0.)
+        dy = np.maximum(np.maximum(rect.top() - y, y - rect.bottom()), 0.)
+        return np.nan_to_num(np.hypot(dx, dy), nan=np.inf)
+
+    def materialLayersChanged(self):
+        '''
+        Hands changed materials on to the view extents, the density layer follows from densityTimer.
+        '''
+        # While populating, fitView already fits the materials still to come.
+        rect = self.materialLayer.boundingRect()
+        if self.isPopulating():
+            if self.populateBounds is None:
+                self.populateBounds = self.materialLayer.rowsBounds(
+                    np.concatenate((self.materialLayer.drawnRows(), self.populateQueue)))
+            rect = self.populateBounds
+        # The layer may be hidden by the density mode, fit it anyway.
+        self.view.updateGraphicItem(self.materialLayer, rect)
+        if not self.isPopulating():
+            # Counting per slice would rebuild the index every time, the last slice starts it once.
+            self.densityTimer.start()
+
+    def syncDensity(self):
+        '''
+        Builds the grid index of the changed materials and shows the heatmap or the ellipses for them.
+        '''
+        self.materialLayer.index()
+        self.densityLayer.geometryChanged()
+        self.updateDensity()
+
+    def updateDensity(self):
+        '''
+        Shows the heatmap or the ellipses, depending on the density mode and the materials in view.
+        '''
+        if self.densityMode == DENSITY_AUTO:
+            threshold = DENSITY_EXIT_COUNT if self.isDensityShown() else DENSITY_ENTER_COUNT
+            shown = self.materialLayer.countIn(self.view.viewportState().rect) > threshold
+        else:
+            shown = self.densityMode == DENSITY_ON
+        self.showDensity(shown)
+
+    def showDensity(self, shown: bool):
+        if shown != self.isDensityShown():
+            self.densityLayer.setVisible(shown)
+            self.materialLayer.setVisible(not shown)
+            self.labelLayer.setVisible(not shown)
+
+    def syncMaterialLayer(self):
+        '''
+        Hands the current plot geometry to the material and label layers, drawn materials are matched
+        by name because rows move when the data changes.
+        '''
+        geometry = self.transformer.transformAll(self.model)
+        if self.materialLayer.scene() is None:
+            self.scene.addItem(self.materialLayer)
+            self.view.addGraphicItem(self.materialLayer)
+        if self.labelLayer.scene() is None:
+            # Labels are left out of graphicItems, fitView only fits the ellipses and hulls.
+            self.scene.addItem(self.labelLayer)
+        if self.densityLayer.scene() is None:
+            self.scene.addItem(self.densityLayer)
+        if geometry is not self.layerGeometry:
+            table = self.model.getTable()
+            self.populateBounds = None
+            # Larger ellipses keep their labels when labels overlap.
+            priorities = np.abs(geometry.rects[:, 2] * geometry.rects[:, 3])
+            if self.layerTable is table:
+                # Same materials in a new plot space, e.g. after a config change: move them in place.
+                self.materialLayer.updateGeometry(geometry.rects, geometry.rotations)
+                self.labelLayer.updateAnchors(geometry.centers, priorities)
+                self.layerGeometry = geometry
+                return geometry
+            rows = [table.rowByName[label] for label in self.ellipseItems if label in table.rowByName]
+            if self.isPopulating():
+                # Rows move with the new table, keep populating the same materials.
+                labels = self.layerTable.labels[self.stopPopulation()]
+                self.populateQueue = np.array([table.rowByName[label] for label in labels if label in table.rowByName],
+                                              dtype=np.intp)
+                self.populateViewport = None
+                self.populateTimer.start()
+            self.materialLayer.setGeometry(geometry.rects, geometry.rotations, table.colors, rows)
+            self.labelLayer.setLabels(geometry.centers, table.labels, priorities, rows)
+            self.layerGeometry = geometry
+            self.layerTable = table
+            self.selectLabels(self.tree.getSelections())
+        return geometry
+
+    def selectLabels(self, labels: List[str]):
+        '''
+        Labels of the selected materials are placed before all others.
+        '''
+        rows = self.model.getTable().rowByName
+        self.labelLayer.setSelectedRows([rows[label] for label in labels if label in rows])
 
     def drawHull(self, items: List[MaterialItem]):
+        if not isinstance(items, HullGroup):
+            items = HullGroup(items)
         if len(items) > 0:
-            r, g, b = self.model.getMeanColor(items)
-            self.pen = QPen(QColor(125, 125, 125, 50), 0)
-            self.brush = QBrush(QColor(r, g, b, 100))
-            poly = self.scene.addPolygon(self.transformer.getEllipseHull(items), self.pen, self.brush)
-            poly.setZValue(-1)
-            self.semanticItems.append(items)
-            self.view.graphicItems.append(poly)
+            self.addHullPolygon(items, self.transformer.getEllipseHull(items, self.model))
+
+    def submitHull(self, items: HullGroup):
+        '''
+        Computes the hull in the background, it is added to the scene by onHullReady.
+        Hulls found in the transformer's cache are drawn right away.
+        '''
+        if len(items) == 0:
+            return
+        rows = items.rows if items.table is self.model.getTable() else None
+        key, job = self.transformer.prepareHull(items, self.model, rows)
+        hull_v = self.transformer.cachedHull(key)
+        if hull_v is not None:
+            self.drawHullVertices(items, hull_v)
+            return
+        self.pendingHulls[id(items)] = (items, key)
+        self.hullTasks.submit(items, job)
+
+    def cancelHulls(self):
+        '''
+        Drops the hulls in flight and returns their groups, so the caller can queue them again.
+        '''
+        pending = [items for items, _ in self.pendingHulls.values()]
+        self.hullTasks.cancel()
+        self.pendingHulls.clear()
+        return pending
+
+    def onHullReady(self, items: HullGroup, hull_v):
+        _, key = self.pendingHulls.pop(id(items), (items, None))
+        if key is not None:
+            self.transformer.storeHull(key, hull_v)
+        self.drawHullVertices(items, hull_v)
+        self.fitWhenHullsDrawn()
+
+    def drawHullVertices(self, items: HullGroup, hull_v):
+        self.addHullPolygon(items, self.transformer.hullPolygon(hull_v))
+
+    def onHullFailed(self, items: HullGroup, message: str):
+        self.pendingHulls.pop(id(items), None)
+        print("Hull of %s could not be computed: %s" % (items.key or "all materials", message))
+        self.fitWhenHullsDrawn()
+
+    def fitWhenHullsDrawn(self):
+        if self.fitPending and not self.pendingHulls:
+            self.fitPending = False
+            self.view.fitView()
+
+    def addHullPolygon(self, items: List[MaterialItem], polygon: QPolygonF):
+        drawn = self.hullItems.get(items.key) if isinstance(items, HullGroup) else None
+        if drawn is not None:
+            # The hull of this key is drawn already, e.g. a new outline or the hull drawn again: update it in place.
+            poly = drawn[1]
+            if drawn[0] is not items:
+                r, g, b = self.model.getMeanColor(items)
+                poly.setBrush(QBrush(QColor(r, g, b, 100)))
+                self.hullItems[items.key] = (items, poly)
+            if poly.polygon() != polygon:
+                poly.setPolygon(polygon)
+            poly.show()
+            self.view.updateGraphicItem(poly)
+            return
+        r, g, b = self.model.getMeanColor(items)
+        self.pen = QPen(QColor(125, 125, 125, 50), 0)
+        self.brush = QBrush(QColor(r, g, b, 100))
+        poly = self.scene.addPolygon(polygon, self.pen, self.brush)
+        poly.setZValue(-1)
+        if isinstance(items, HullGroup):
+            self.hullItems[items.key] = (items, poly)
+        self.view.addGraphicItem(poly)
+
+    def removeItems(self, items: List[QGraphicsItem]):
+        '''
+        Removes graphic items from the scene and the view.
+        '''
+        for item in items:
+            self.scene.removeItem(item)
+        self.view.removeGraphicItems(items)
 
     def drawLine(self):
         # fake example, make your draw with your data
@@ -120,20 +576,21 @@ class AshbyGraphicsController(object):
             graphicitem = self.scene.addLine(mean - 10, std - 10, mean + 10, std + 10, self.pen)
             graphicitem2 = self.scene.addLine(mean - 10, std + 10, mean + 10, std - 10, self.pen)
 
-            self.view.graphicItems.append(graphicitem)  # not necessary at present, for further use
-            self.view.graphicItems.append(graphicitem2)  # not necessary at present, for further use
+            self.view.addGraphicItem(graphicitem)  # not necessary at present, for further use
+            self.view.addGraphicItem(graphicitem2)  # not necessary at present, for further use
 
 
     def updateGraphicItems(self):
         '''
-        Iterates over the existing items and re-draw them with the latest config.
-        '''
-        prev_items = self.semanticItems.copy()
-        self.clearScene()
-        for item in prev_items:
-            # If it is one item, draw the corresponding ellipse.
-            if isinstance(item, MaterialItem):
-                self.drawEllipse(item)
-            # If it is a list of items, draw their convex hull.
-            if isinstance(item, list):
-                self.drawHull(item)
\ No newline at end of file
+        Updates the drawn items in place for the latest config: the layers get the new geometry arrays and
+        every hull is computed again, its polygon stays hidden until the new outline replaces it.
+        '''
+        if self.ellipseItems or self.isPopulating():
+            self.syncMaterialLayer()
+            self.materialLayersChanged()
+        groups = [group for group, _ in self.hullItems.values()] + self.cancelHulls()
+        for _, poly in self.hullItems.values():
+            poly.hide()
+            self.view.updateGraphicItem(poly)
+        for group in {id(group): group for group in groups}.values():
+            self.submitHull(group)
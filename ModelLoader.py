@@ -0,0 +1,74 @@
+# -*- coding:utf-8 -*-
+import threading
+
+from PySide2.QtCore import QObject, Signal
+
+from BackgroundTasks import BackgroundTasks
+from DataCache import DataCache
+from DataIngestion import LoadCancelled
+from DataModel import AshbyModel
+
+
+class ModelLoader(QObject):
+    '''
+    Builds an AshbyModel on a worker thread so the window stays responsive while a dataset loads.
+    Progress and the outcome arrive on the Qt thread through the signals below. Only the latest
+    load counts: load() and cancel() drop the load in flight, it stops at its next chunk or file.
+    '''
+    progress = Signal(str, int, int)
+    loaded = Signal(str, object)
+    failed = Signal(str, str)
+    cancelled = Signal(str)
+
+    def __init__(self, cache: DataCache = None, parent: QObject = None):
+        super(ModelLoader, self).__init__(parent)
+        self.cache = cache
+        # One worker, a new load waits for a cancelled one to reach its next chunk or file.
+        self.tasks = BackgroundTasks(max_workers=1)
+        self.tasks.finished.connect(self.onFinished)
+        self.tasks.failed.connect(self.onFailed)
+        self.filename = None
+        self.stopEvent = None
+
+    #
+    # Public
+    #
+    def load(self, filename: str):
+        self.cancel()
+        self.filename = filename
+        self.stopEvent = threading.Event()
+        self.tasks.submit(filename, self.buildModel, filename, self.stopEvent)
+
+    def cancel(self):
+        if not self.isLoading():
+            return
+        self.stopEvent.set()
+        self.tasks.cancel()
+        filename, self.filename, self.stopEvent = self.filename, None, None
+        self.cancelled.emit(filename)
+
+    def isLoading(self):
+        return self.stopEvent is not None
+
+    def shutdown(self):
+        self.cancel()
+        self.tasks.shutdown()
+
+    #
+    # Private
+    #
+    def buildModel(self, filename: str, stop_event: threading.Event):
+        # Runs on the worker thread, signals emitted here are queued to the Qt thread.
+        def progress(read_bytes: int, total_bytes: int):
+            if stop_event.is_set():
+                raise LoadCancelled()
+            self.progress.emit(filename, read_bytes, total_bytes)
+        return AshbyModel(filename, progress=progress, cache=self.cache, stop_event=stop_event)
+
+    def onFinished(self, filename: str, model: AshbyModel):
+        self.filename = self.stopEvent = None
+        self.loaded.emit(filename, model)
+
+    def onFailed(self, filename: str, message: str):
+        self.filename = self.stopEvent = None
+        self.failed.emit(filename, message)
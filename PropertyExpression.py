@@ -0,0 +1,240 @@
+# -*- coding:utf-8 -*-
+import re
+from functools import lru_cache
+from typing import Callable
+
+import numpy as np
+
+from AlgorithmUtils import LRUCache
+
+# Column names with spaces or operators can be written as `Thermal Conductivity` or [Thermal Conductivity].
+TOKEN_PATTERN = re.compile(r"\s*(?:(?P<number>(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?)"
+                           r"|(?P<name>[A-Za-z_][A-Za-z0-9_.]*)"
+                           r"|`(?P<quoted>[^`]+)`|\[(?P<bracketed>[^\]]+)\]"
+                           r"|(?P<op>\*\*|[-+*/^(),]))")
+FUNCTIONS = {
+    "sqrt": np.sqrt,
+    "log": np.log,
+    "log10": np.log10,
+    "exp": np.exp,
+    "abs": np.abs,
+}
+BINARY_OPERATORS = {
+    "+": np.add,
+    "-": np.subtract,
+    "*": np.multiply,
+    "/": np.true_divide,
+    "^": np.power,
+}
+PROPERTY_CACHE_SIZE = 64
+
+
+class ExpressionError(ValueError):
+    pass
+
+
+class CompiledExpression(object):
+    '''
+    A parsed derived-property expression such as `E^(1/2)/rho`.
+    The syntax tree is made of tuples: ("num", value), ("col", name), ("neg", a),
+    ("bin", op, a, b) and ("fn", name, a). Constant sub-expressions are folded while parsing.
+    '''
+
+    def __init__(self, text: str):
+        self.text = text
+        self.tokens = self.tokenize(text)
+        self.position = 0
+        self.tree = self.parseSum()
+        if self.position != len(self.tokens):
+            raise ExpressionError("Unexpected '%s' in '%s'." % (self.tokens[self.position][1], text))
+        del self.tokens
+        # Two spellings of the same expression share this key, e.g. `E^0.5 / rho` and `(E^(1/2))/rho`.
+        self.key = self.canonical(self.tree)
+        self.columns = frozenset(self.collectColumns(self.tree))
+
+    def bind(self, rename: Callable[[str], str]):
+        '''
+        Return a copy whose column references are replaced by `rename(name)`, e.g. aliases by real columns.
+        '''
+        bound = CompiledExpression.__new__(CompiledExpression)
+        bound.text = self.text
+        bound.tree = self.renameColumns(self.tree, rename)
+        bound.key = self.canonical(bound.tree)
+        bound.columns = frozenset(self.collectColumns(bound.tree))
+        return bound
+
+    def evaluate(self, resolve: Callable[[str], np.ndarray]):
+        '''
+        Evaluate over whole columns at once, `resolve(name)` returns the values of a column.
+        '''
+        with np.errstate(divide="ignore", invalid="ignore", over="ignore"):
+            return np.asarray(self.evaluateNode(self.tree, resolve), dtype=np.float64)
+
+    #
+    # Private
+    #
+    @staticmethod
+    def tokenize(text: str):
+        tokens = []
+        position = 0
+        text = text.rstrip()
+        while position < len(text):
+            match = TOKEN_PATTERN.match(text, position)
+            if not match:
+                raise ExpressionError("Cannot parse '%s' at position %d." % (text, position))
+            position = match.end()
+            kind = match.lastgroup
+            value = match.group(kind)
+            if kind == "number":
+                tokens.append(("num", float(value)))
+            elif kind == "op":
+                tokens.append(("op", "^" if value == "**" else value))
+            else:
+                tokens.append(("name", value.strip()))
+        return tokens
+
+    def peek(self):
+        return self.tokens[self.position] if self.position < len(self.tokens) else (None, None)
+
+    def take(self, op: str = None):
+        token = self.peek()
+        if op is not None and token != ("op", op):
+            raise ExpressionError("Expected '%s' in '%s'." % (op, self.text))
+        self.position += 1
+        return token
+
+    def parseSum(self):
+        node = self.parseProduct()
+        while self.peek() in (("op", "+"), ("op", "-")):
+            node = self.binary(self.take()[1], node, self.parseProduct())
+        return node
+
+    def parseProduct(self):
+        node = self.parseUnary()
+        while self.peek() in (("op", "*"), ("op", "/")):
+            node = self.binary(self.take()[1], node, self.parseUnary())
+        return node
+
+    def parseUnary(self):
+        # Unary minus binds weaker than the power: -a^2 == -(a^2).
+        if self.peek() == ("op", "-"):
+            self.take()
+            node = self.parseUnary()
+            return ("num", -node[1]) if node[0] == "num" else ("neg", node)
+        if self.peek() == ("op", "+"):
+            self.take()
+            return self.parseUnary()
+        return self.parsePower()
+
+    def parsePower(self):
+        node = self.parseAtom()
+        if self.peek() == ("op", "^"):
+            self.take()
+            # Right associative: a^b^c == a^(b^c).
+            node = self.binary("^", node, self.parseUnary())
+        return node
+
+    def parseAtom(self):
+        kind, value = self.take()
+        if kind == "num":
+            return ("num", value)
+        if kind == "name":
+            if value in FUNCTIONS and self.peek() == ("op", "("):
+                self.take("(")
+                argument = self.parseSum()
+                self.take(")")
+                if argument[0] == "num":
+                    return ("num", float(FUNCTIONS[value](argument[1])))
+                return ("fn", value, argument)
+            return ("col", value)
+        if (kind, value) == ("op", "("):
+            node = self.parseSum()
+            self.take(")")
+            return node
+        raise ExpressionError("Unexpected end of '%s'." % self.text if kind is None
+                              else "Unexpected '%s' in '%s'." % (value, self.text))
+
+    @staticmethod
+    def binary(op: str, a: tuple, b: tuple):
+        if a[0] == "num" and b[0] == "num":
+            with np.errstate(all="ignore"):
+                return ("num", float(BINARY_OPERATORS[op](a[1], b[1])))
+        return ("bin", op, a, b)
+
+    @classmethod
+    def canonical(cls, node: tuple):
+        kind = node[0]
+        if kind == "num":
+            return repr(node[1])
+        if kind == "col":
+            return "[%s]" % node[1]
+        if kind == "neg":
+            return "(-%s)" % cls.canonical(node[1])
+        if kind == "fn":
+            return "%s(%s)" % (node[1], cls.canonical(node[2]))
+        return "(%s %s %s)" % (cls.canonical(node[2]), node[1], cls.canonical(node[3]))
+
+    @classmethod
+    def collectColumns(cls, node: tuple):
+        kind = node[0]
+        if kind == "col":
+            return [node[1]]
+        if kind == "num":
+            return []
+        if kind == "bin":
+            return cls.collectColumns(node[2]) + cls.collectColumns(node[3])
+        return cls.collectColumns(node[-1])
+
+    @classmethod
+    def renameColumns(cls, node: tuple, rename: Callable[[str], str]):
+        kind = node[0]
+        if kind == "col":
+            return ("col", rename(node[1]))
+        if kind == "num":
+            return node
+        if kind == "bin":
+            return ("bin", node[1], cls.renameColumns(node[2], rename), cls.renameColumns(node[3], rename))
+        return node[:-1] + (cls.renameColumns(node[-1], rename),)
+
+    @classmethod
+    def evaluateNode(cls, node: tuple, resolve: Callable[[str], np.ndarray]):
+        kind = node[0]
+        if kind == "num":
+            return node[1]
+        if kind == "col":
+            return resolve(node[1])
+        if kind == "neg":
+            return np.negative(cls.evaluateNode(node[1], resolve))
+        if kind == "fn":
+            return FUNCTIONS[node[1]](cls.evaluateNode(node[2], resolve))
+        return BINARY_OPERATORS[node[1]](cls.evaluateNode(node[2], resolve), cls.evaluateNode(node[3], resolve))
+
+
+@lru_cache(maxsize=256)
+def compileExpression(text: str):
+    '''
+    Parse an expression once, repeated requests of the same text reuse the compiled tree.
+    '''
+    return CompiledExpression(text)
+
+
+class PropertyCache(object):
+    '''
+    Bounded LRU memo of evaluated expressions keyed by their canonical form, cleared whenever the data changes.
+    '''
+
+    def __init__(self, max_entries: int = PROPERTY_CACHE_SIZE):
+        self.entries = LRUCache(max_entries)
+
+    def evaluate(self, expression: CompiledExpression, resolve: Callable[[str], np.ndarray]):
+        values = self.entries.get(expression.key)
+        if values is not None:
+            return values
+        values = expression.evaluate(resolve)
+        # Results are shared between callers, so keep them immutable.
+        values.setflags(write=False)
+        self.entries.put(expression.key, values)
+        return values
+
+    def clear(self):
+        self.entries.clear()
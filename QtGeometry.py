@@ -0,0 +1,52 @@
+# -*- coding:utf-8 -*-
+'''
+Conversion of NumPy point arrays to Qt geometry without one Python QPointF per vertex.
+The points are written into a single buffer in the QDataStream layout of QVector<QPointF>
+(a uint32 count followed by x, y doubles) and deserialized by Qt in C++.
+'''
+import numpy as np
+from PySide2.QtCore import QByteArray, QDataStream, QIODevice
+from PySide2.QtGui import QPainterPath, QPolygonF
+
+# Native little-endian doubles, so converting a float64 array is a plain memory copy.
+POINT_DTYPE = np.dtype("<f8")
+COUNT_DTYPE = np.dtype("<u4")
+
+
+def polygonBytes(points: np.ndarray):
+    points = np.ascontiguousarray(points, dtype=POINT_DTYPE).reshape(-1, 2)
+    return np.array([len(points)], dtype=COUNT_DTYPE).tobytes() + points.tobytes()
+
+
+def readPolygon(stream: QDataStream):
+    polygon = QPolygonF()
+    stream >> polygon
+    return polygon
+
+
+def openStream(data: QByteArray):
+    stream = QDataStream(data, QIODevice.ReadOnly)
+    stream.setByteOrder(QDataStream.LittleEndian)
+    stream.setFloatingPointPrecision(QDataStream.DoublePrecision)
+    return stream
+
+
+def polygonFromArray(points: np.ndarray):
+    '''
+    QPolygonF of an (n x 2) array of x, y.
+    '''
+    # Keep the QByteArray referenced while the stream reads from it.
+    data = QByteArray(polygonBytes(points))
+    return readPolygon(openStream(data))
+
+
+def pathFromArray(points: np.ndarray, closed: bool = True):
+    '''
+    QPainterPath through an (n x 2) array of x, y, closed back to the first point by default.
+    '''
+    path = QPainterPath()
+    polygon = polygonFromArray(points)
+    if closed and not polygon.isClosed() and len(polygon) > 0:
+        polygon.append(polygon.first())
+    path.addPolygon(polygon)
+    return path
@@ -1,7 +1,7 @@
 # -*- coding:utf-8 -*-
 import PySide2.QtGui
-from PySide2.QtWidgets import QGraphicsScene, QGraphicsView, QGraphicsTextItem
-from PySide2.QtCore import QPointF, QRectF, Qt
+from PySide2.QtWidgets import QGraphicsScene, QGraphicsView
+from PySide2.QtCore import QPointF, QRectF, Qt, Signal
 from PySide2.QtGui import QTransform
 from .AxisObjects import MarkLine, VerticalMarkLine, VShadowMarkLine, HShadowMarkLine, IndicatorLines, Test
 import math
@@ -9,13 +9,35 @@ import math
 FIT_EXPAND_MARGIN_RATIO = 0.1
 
 
+class ViewportState(object):
+    '''
+    Snapshot of what the view shows: the visible scene rect, the view scale and the inverse of the
+    viewport transform. `version` grows with every new snapshot.
+    '''
+
+    def __init__(self, rect: QRectF, view_scale: float, inverse: QTransform, version: int):
+        self.rect = rect
+        self.viewScale = view_scale
+        self.inverse = inverse
+        self.version = version
+
+    def mapToScene(self, pos: QPointF):
+        return self.inverse.map(QPointF(pos))
+
+
 class AGraphicsView(QGraphicsView):
+    # Emitted with the new viewScale (pixels per scene unit) whenever the zoom changes.
+    viewScaleChanged = Signal(float)
+    # Emitted whenever the visible scene rect changed, by panning, zooming or resizing.
+    viewportChanged = Signal()
+
     def __init__(self, parent):
         super(AGraphicsView, self).__init__(parent)
         # initialize
         self.viewScale = 100.0
         self.scaleValue = math.log(self.viewScale)
         self.rightDrag = False
+        self.signalledScale = None
 
         self.viewPosInScene = self.initPos
         self.lastViewPosInScene = self.initPos
@@ -25,6 +47,14 @@ class AGraphicsView(QGraphicsView):
         self._indicator = self._hMarkline = self._vMarkline = self._hsMarkline = self._vsMarkline = None
 
         self.graphicItems = []
+        # Bounding rects of graphicItems by id and their union, None until it is computed again.
+        self.itemBounds = {}
+        self._extents = QRectF()
+        # The viewport snapshot shared by the axis and indicator items, see viewportState().
+        self._viewportState = None
+        self.viewportVersion = 0
+        # Number of times the viewport was mapped to the scene, at most once per frame.
+        self.viewportMappings = 0
 
     def changeAxisMode(self, mode):
         if self._hMarkline:
@@ -64,9 +94,71 @@ class AGraphicsView(QGraphicsView):
 
         return super(AGraphicsView, self).mousePressEvent(mouseEvent)
 
+    def addGraphicItem(self, item):
+        self.graphicItems.append(item)
+        self.updateGraphicItem(item)
+
+    def updateGraphicItem(self, item, rect: QRectF = None):
+        '''
+        Takes the new bounding rect of a graphic item into the extents used by fitView(), hidden items are left out.
+        An item still being populated can pass the `rect` it will cover instead.
+        '''
+        if rect is None:
+            rect = item.boundingRect() if item.isVisible() else QRectF()
+        previous = self.itemBounds.get(id(item))
+        self.itemBounds[id(item)] = rect
+        if previous is not None and not previous.isNull() and not rect.contains(previous):
+            # The item shrank or moved, the union has to be computed again.
+            self._extents = None
+        elif self._extents is not None:
+            self._extents = self._extents.united(rect)
+
+    def removeGraphicItems(self, items):
+        removed = set(map(id, items))
+        self.graphicItems[:] = [item for item in self.graphicItems if id(item) not in removed]
+        for key in removed:
+            self.itemBounds.pop(key, None)
+        self._extents = None
+
+    def clearGraphicItems(self):
+        self.graphicItems.clear()
+        self.itemBounds.clear()
+        self._extents = QRectF()
+
+    def graphicExtents(self):
+        '''
+        Union of the bounding rects of all graphic items.
+        '''
+        if self._extents is None:
+            self._extents = QRectF()
+            for rect in self.itemBounds.values():
+                self._extents = self._extents.united(rect)
+        return QRectF(self._extents)
+
+    def viewportState(self):
+        '''
+        The current ViewportState, the view is only mapped again after invalidateViewport().
+        '''
+        if self._viewportState is None:
+            self.viewportMappings += 1
+            self.viewportVersion += 1
+            inverse, _ = self.viewportTransform().inverted()
+            self._viewportState = ViewportState(inverse.mapRect(QRectF(self.rect())), self.viewScale,
+                                                inverse, self.viewportVersion)
+        return self._viewportState
+
+    def invalidateViewport(self):
+        self._viewportState = None
+
     def getViewRect(self):
-        # todo: performance bottleneck
-        return self.mapToScene(self.rect()).boundingRect()
+        return self.viewportState().rect
+
+    def resizeEvent(self, event):
+        result = super(AGraphicsView, self).resizeEvent(event)
+        if event.size() != event.oldSize():
+            self.invalidateViewport()
+            self.viewportChanged.emit()
+        return result
 
     def mouseMoveEvent(self, mouseEvent):
         mousePos = QPointF(mouseEvent.pos())
@@ -77,7 +169,7 @@ class AGraphicsView(QGraphicsView):
 
             self.resetSceneRect()
         if self._indicator:
-            self._indicator.onHoverChanged(self.mapToScene(mousePos.x(), mousePos.y()))
+            self._indicator.onHoverChanged(self.viewportState().mapToScene(mousePos))
         return super(AGraphicsView, self).mouseMoveEvent(mouseEvent)
 
     def mouseReleaseEvent(self, mouseEvent):
@@ -114,15 +206,10 @@ class AGraphicsView(QGraphicsView):
         return super(AGraphicsView, self).wheelEvent(mouseEvent)
 
     def fitView(self):
-        if not self.graphicItems:
+        rect = self.graphicExtents()
+        if rect.isEmpty():
             self.resetView()
             return
-        rect = QRectF()
-        for item in self.graphicItems:
-            if isinstance(item, QGraphicsTextItem):
-                continue
-            bb = item.boundingRect()
-            rect = rect.united(bb)
         if rect.width() < rect.height():
             rect.setWidth(rect.height())
         else:
@@ -176,8 +263,10 @@ class AGraphicsView(QGraphicsView):
         trans = QTransform()
         trans.scale(self.viewScale, self.viewScale)
         self.setTransform(trans)
-        for item in self.graphicItems:
-            if isinstance(item, QGraphicsTextItem):
-                item.setScale(1.0 / self.viewScale)
+        self.invalidateViewport()
         self.scene().update()
         self.refreshMarks()
+        if self.viewScale != self.signalledScale:
+            self.signalledScale = self.viewScale
+            self.viewScaleChanged.emit(self.viewScale)
+        self.viewportChanged.emit()
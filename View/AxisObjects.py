@@ -4,10 +4,11 @@
 from PySide2.QtWidgets import QGraphicsObject, QGraphicsItem, QGraphicsTextItem
 from PySide2.QtGui import QBrush, QPen, QColor, QFont, QPolygonF
 from PySide2.QtCore import QLineF, QPointF, QRectF, Qt
-import math
 
-MARKTRACK_MODE_LINEAR = 0
-MARKTRACK_MODE_LOGSCALE = 1
+from .TickLayout import TICK_ENGINE, TICK_MODE_LINEAR, TICK_MODE_LOGSCALE
+
+MARKTRACK_MODE_LINEAR = TICK_MODE_LINEAR
+MARKTRACK_MODE_LOGSCALE = TICK_MODE_LOGSCALE
 
 MARKTRACK_HEIGHT = 40  # 刻度条的高度
 
@@ -32,13 +33,6 @@ TICKMARK_HEIGHT = 8
 MAJORTICK_HEIGHT = 19.0
 MINORTICK_HEIGHT = 10.0
 
-MINOR_TICK_COUNT = 10
-
-# units of linearscale corresponding to logscale
-LOGSCALE_UNITS = 1000.0
-LINEARSCALE_UNITS = 1000.0
-LINEAR_TO_LOG = LINEARSCALE_UNITS / LOGSCALE_UNITS
-
 # 轨道的边框颜色:
 TRACK_BORDER_COLOR = QColor("#202020")
 
@@ -46,6 +40,9 @@ TRACK_BORDER_COLOR = QColor("#202020")
 class MarkLine(QGraphicsObject):
     """docstring for MarkLine: 刻度线."""
     TEXTANGLE = 0
+    # the axis value is -y for vertical axes
+    FLIPPED = False
+    SHOW_TEXT = True
     MAJORTICK_COLOR = QColor(112, 112, 112, 255)
     MINORTICK_COLOR = QColor(112, 112, 112, 102)
 
@@ -56,6 +53,7 @@ class MarkLine(QGraphicsObject):
         self.textitem = None
         self._axisMode = MARKTRACK_MODE_LOGSCALE
         self._markTextItem = []
+        self._markTexts = []
         self._markLines = []
         self._markLinesBold = []
         self._viewRect = None
@@ -70,127 +68,32 @@ class MarkLine(QGraphicsObject):
 
     @property
     def axisMin(self):
-        rect = self.view.getViewRect()
+        rect = self.view.viewportState().rect
         return rect.left()
 
     @property
     def axisMax(self):
-        rect = self.view.getViewRect()
+        rect = self.view.viewportState().rect
         return rect.right()
 
     def makeMajorLine(self, a):
-        rect = self.view.getViewRect()
+        rect = self.view.viewportState().rect
         return QLineF(a, rect.bottom() - (TICKMARK_BAR_HEIGHT - MAJORTICK_HEIGHT) / self.view_scale, a,
                       rect.bottom() - TICKMARK_BAR_HEIGHT / self.view_scale)
 
-    def transFormLogMinorCoord(self, a, basea=None, base=None):
-        if self._axisMode == MARKTRACK_MODE_LOGSCALE and basea is not None:
-            a = math.log10(a + 1) * base + basea
-        return a
-    def makeMinorLine(self, a, basea=None, base=None):
-        rect = self.view.getViewRect()
-
-        a = self.transFormLogMinorCoord(a, basea, base)
-
+    def makeMinorLine(self, a):
+        rect = self.view.viewportState().rect
         return QLineF(a, rect.bottom() - (TICKMARK_BAR_HEIGHT - MINORTICK_HEIGHT) / self.view_scale, a,
                       rect.bottom() - TICKMARK_BAR_HEIGHT / self.view_scale)
 
     def makeTextPos(self, a):
-        rect = self.view.getViewRect()
+        rect = self.view.viewportState().rect
         y = rect.bottom() - 30 / self.view_scale
         return QPointF(a, y)
 
-    def getLogLevel(self):
-        max, min = self.lin2log(self.axisMax) , self.lin2log(self.axisMin)
-        maxbase = math.ceil(math.log10(max))
-        minbase = math.floor(math.log10(min))
-        print(minbase, maxbase)
-
-    def _generateLogText(self, i, a):
-        # add tick texts
-        if i >= len(self._markTextItem):
-            item = QGraphicsTextItem(self)
-            item.setFont(TICKS_TEXT_FONT)
-            item.setDefaultTextColor(TICKS_TEXT_COLOR)
-            item.setZValue(0)
-            item.setRotation(self.TEXTANGLE)
-            item.setFlag(QGraphicsItem.ItemIgnoresTransformations)
-            self._markTextItem.append(item)
-        else:
-            item = self._markTextItem[i]
-        item.setPos(self.makeTextPos(self.log2lin(a)))
-        item.setPlainText(self.getMarkText(self.log2lin(a)))
-        item.show()
-    def logUpdateMark(self):
-        maxlog, minlog = self.lin2log(self.axisMax), self.lin2log(self.axisMin)
-        for item in self._markTextItem:
-            item.hide()
-        lines = []
-        maxlogbase = math.log10(maxlog)
-        minlogbase = math.log10(minlog)
-        maxbase = math.ceil(maxlogbase)
-        minbase = math.floor(minlogbase)
-        div = maxbase - minbase
-        if div < 3:
-            # case2
-            minorbase = 10 ** math.floor(math.log10(maxlog - minlog))
-            divs = int((maxlog - minlog)/minorbase)
-            if divs < 2:
-                divs *= 10
-                base = minorbase * 0.1
-            else:
-                base = minorbase
-            a = math.floor(minlog / base) * base
-            i = 0
-            while a < self.axisMax:
-                # calc major ticks
-                lines.append(self.makeMajorLine(self.log2lin(a)))
-                self._generateLogText(i, a)
-                i += 1
-                a += base
-        else:
-            i = 0
-            for j in range(minbase, maxbase):
-                ivalue = 10 ** j
-                # calc major ticks
-                lines.append(self.makeMajorLine(self.log2lin(ivalue)))
-                self._generateLogText(i, ivalue)
-                i += 1
-
-
-        self._markLinesBold = lines
-
-
-    def linearUpdateMark(self):
-        arange = self.axisMax - self.axisMin
-        divs = int(arange / 10 ** math.floor(math.log10(arange)))
-        # divs: how many major ticks in view
-        if divs < 2:
-            divs *= 10
-            base = 10 ** (math.floor(math.log10(arange)) - 1)
-        else:
-            base = 10 ** (math.floor(math.log10(arange)))
-        # base: 0.1 1 10 100, etc
-        lines = []
-        minor_lines = []
-        i = 0
-        # hide all textitem first
-        for item in self._markTextItem:
-            item.hide()
-        a = math.floor(self.axisMin / base) * base
-        while a < self.axisMax:
-            i += 1
-            # calc major ticks
-            lines.append(self.makeMajorLine(a))
-            # calc minor ticks
-            if self._axisMode == MARKTRACK_MODE_LINEAR or base > 1:
-                for j in range(1, MINOR_TICK_COUNT):
-                    mina = a + j * base / MINOR_TICK_COUNT
-                    minor_lines.append(self.makeMinorLine(mina))
-            else:
-                for j in range(1, MINOR_TICK_COUNT - 1):
-                    minor_lines.append(self.makeMinorLine(j, a, base))
-            # add tick texts
+    def updateMarkText(self, majors, labels):
+        # reuse the pooled text items, only relayout the ones whose text changed
+        for i, (a, text) in enumerate(zip(majors, labels)):
             if i >= len(self._markTextItem):
                 item = QGraphicsTextItem(self)
                 item.setFont(TICKS_TEXT_FONT)
@@ -199,49 +102,28 @@ class MarkLine(QGraphicsObject):
                 item.setRotation(self.TEXTANGLE)
                 item.setFlag(QGraphicsItem.ItemIgnoresTransformations)
                 self._markTextItem.append(item)
-            else:
-                item = self._markTextItem[i]
+                self._markTexts.append(None)
+            item = self._markTextItem[i]
             item.setPos(self.makeTextPos(a))
-            item.setPlainText(self.getMarkText(a))
+            if self._markTexts[i] != text:
+                item.setPlainText(text)
+                self._markTexts[i] = text
             item.show()
+        for item in self._markTextItem[len(labels):]:
+            item.hide()
 
-            a += base
-
-        self._markLinesBold = lines
-        self._markLines = minor_lines
     def updateMark(self, force=False):
         # 获取可视区域
-        rect = self.view.getViewRect()
-        if not force and self._viewRect == rect:
+        state = self.view.viewportState()
+        if not force and self._viewRect == (state.version, self.view_scale):
             return
-        self._viewRect = rect
-        try:
-            arange = self.axisMax - self.axisMin
-            if self._axisMode == MARKTRACK_MODE_LOGSCALE and arange < LINEAR_TO_LOG * 2:
-                # dont paint for now
-                # self.logUpdateMark()
-                pass
-            else:
-                self.linearUpdateMark()
-
-        except OverflowError:
-            pass
-    @staticmethod
-    def lin2log(v):
-        return 10 ** (v / LINEAR_TO_LOG)
-
-    @staticmethod
-    def log2lin(v):
-        return math.log10(v) * LINEAR_TO_LOG
-
-    def getVisualCoord(self, logiccoord):
-        if self._axisMode == MARKTRACK_MODE_LINEAR:
-            return logiccoord
-        else:
-            return self.lin2log(logiccoord)
-
-    def getMarkText(self, a):
-        return "%g" % self.getVisualCoord(a)
+        self._viewRect = (state.version, self.view_scale)
+        ticks = TICK_ENGINE.layout(self._axisMode, self.axisMin, self.axisMax, self.FLIPPED)
+        majors, minors, labels = ticks.visible(self.axisMin, self.axisMax)
+        self._markLinesBold = [self.makeMajorLine(a) for a in majors.tolist()]
+        self._markLines = [self.makeMinorLine(a) for a in minors.tolist()]
+        if self.SHOW_TEXT:
+            self.updateMarkText(majors.tolist(), labels)
 
     def setAxisMode(self, mode):
         self._axisMode = mode
@@ -295,7 +177,7 @@ class MarkLine(QGraphicsObject):
 
     def boundingRect(self):
         """交互范围."""
-        rect = self.view.getViewRect()
+        rect = self.view.viewportState().rect
         height = TICKMARK_BAR_HEIGHT / self.view_scale
         newRect = QRectF(rect.left(), rect.bottom() - height, rect.width(), height)
         return newRect
@@ -313,48 +195,40 @@ class MarkLine(QGraphicsObject):
 
 class VerticalMarkLine(MarkLine):
     TEXTANGLE = 90
+    FLIPPED = True
 
     def boundingRect(self):
         """交互范围."""
-        rect = self.view.getViewRect()
+        rect = self.view.viewportState().rect
         width = TICKMARK_BAR_WIDTH / self.view_scale
         newRect = QRectF(rect.left(), rect.top(), width, rect.height())
         return newRect
-    def transFormLogMinorCoord(self, a, basea=None, base=None):
-        if self._axisMode == MARKTRACK_MODE_LOGSCALE and basea is not None:
-            a = (1 - math.log10(a + 1)) * base + basea
-        return a
     def getBorderLine(self, rect):
         x = float(rect.left()) + TICKMARK_BAR_WIDTH / self.view_scale
         return QLineF(x, rect.top(), x, rect.bottom())
 
-    def getMarkText(self, a):
-        return "%g" % self.getVisualCoord(-a)
-
     @property
     def axisMin(self):
-        rect = self.view.getViewRect()
+        rect = self.view.viewportState().rect
         return rect.top()
 
     @property
     def axisMax(self):
-        rect = self.view.getViewRect()
+        rect = self.view.viewportState().rect
         return rect.bottom()
 
     def makeMajorLine(self, a):
-        rect = self.view.getViewRect()
+        rect = self.view.viewportState().rect
         return QLineF(rect.left() + (TICKMARK_BAR_HEIGHT - MAJORTICK_HEIGHT) / self.view_scale, a,
                       rect.left() + TICKMARK_BAR_HEIGHT / self.view_scale, a)
 
-    def makeMinorLine(self, a, basea=None, base=None):
-        rect = self.view.getViewRect()
-
-        a = self.transFormLogMinorCoord(a, basea, base)
+    def makeMinorLine(self, a):
+        rect = self.view.viewportState().rect
         return QLineF(rect.left() + (TICKMARK_BAR_HEIGHT - MINORTICK_HEIGHT) / self.view_scale, a,
                       rect.left() + TICKMARK_BAR_HEIGHT / self.view_scale, a)
 
     def makeTextPos(self, a):
-        rect = self.view.getViewRect()
+        rect = self.view.viewportState().rect
         x = rect.left() + 30 / self.view_scale
         return QPointF(x, a)
 
@@ -390,14 +264,14 @@ class IndicatorLines(QGraphicsObject):
         self.onHoverChanged(self.hoverPos)
     def boundingRect(self):
         """交互范围."""
-        rect = self.view.getViewRect()
+        rect = self.view.viewportState().rect
         return rect
     def setAxisMode(self, mode):
         self._axisMode = mode
         self.onHoverChanged(self.hoverPos)
         self.update()
     def onHoverChanged(self, pos):
-        rect = self.view.getViewRect()
+        rect = self.view.viewportState().rect
         self.hoverPos = pos
         self.vline = QLineF(pos.x(), rect.top(), pos.x(), rect.bottom())
         self.hline = QLineF(rect.left(), pos.y(), rect.right(), pos.y())
@@ -418,6 +292,7 @@ class IndicatorLines(QGraphicsObject):
 
 class HShadowMarkLine(MarkLine):
     MAJORTICK_COLOR = QColor(112, 112, 112, 128)
+    SHOW_TEXT = False
 
     def __init__(self, view):
         super(HShadowMarkLine, self).__init__(view)
@@ -437,21 +312,23 @@ class HShadowMarkLine(MarkLine):
         painter.drawLines(self._markLinesBold)
 
     def makeMajorLine(self, a):
-        rect = self.view.getViewRect()
+        rect = self.view.viewportState().rect
         return QLineF(a, rect.top(), a, rect.bottom())
 
 
 class VShadowMarkLine(HShadowMarkLine):
+    FLIPPED = True
+
     @property
     def axisMin(self):
-        rect = self.view.getViewRect()
+        rect = self.view.viewportState().rect
         return rect.top()
 
     @property
     def axisMax(self):
-        rect = self.view.getViewRect()
+        rect = self.view.viewportState().rect
         return rect.bottom()
 
     def makeMajorLine(self, a):
-        rect = self.view.getViewRect()
+        rect = self.view.viewportState().rect
         return QLineF(rect.left(), a, rect.right(), a)
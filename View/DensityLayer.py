@@ -0,0 +1,123 @@
+# -*- coding:utf-8 -*-
+# @ModuleName: DensityLayer
+
+import math
+
+import numpy as np
+from PySide2.QtWidgets import QGraphicsItem, QStyleOptionGraphicsItem
+from PySide2.QtGui import QImage
+from PySide2.QtCore import QRectF
+
+from .MaterialLayer import MaterialLayer, deviceSceneRect
+
+# Side of a histogram bin on screen, in pixels.
+DENSITY_CELL_PX = 3
+# The histogram covers this share of the visible size beyond each edge, so panning reuses it.
+DENSITY_MARGIN_RATIO = 0.5
+# Zooming by more than this factor (either way) bins again at the new resolution.
+DENSITY_REBIN_ZOOM_RATIO = 1.5
+DENSITY_MAX_BINS = 2048
+# Color ramp from sparse to dense, (r, g, b, a) stops.
+DENSITY_COLORS = np.array([
+    (49, 54, 149, 90),
+    (69, 117, 180, 150),
+    (116, 173, 209, 190),
+    (254, 224, 144, 220),
+    (244, 109, 67, 240),
+    (165, 0, 38, 255),
+], dtype=np.float64)
+
+
+class DensityLayer(QGraphicsItem):
+    """
+    One scene item painting the drawn materials of a MaterialLayer as a density heatmap.
+    The centers are binned into a 2-D histogram, optionally weighted by ellipse area, and painted as one
+    cached QImage. The histogram covers the visible rect with a margin and is only binned again when
+    the view leaves it, the zoom changes substantially or the materials change.
+    """
+
+    def __init__(self, materials: MaterialLayer, parent=None):
+        super(DensityLayer, self).__init__(parent)
+        self.materials = materials
+        self.weighted = False
+        self.image = None
+        self.imageRect = QRectF()
+        self._imageKey = None
+        self._imageScale = None
+        self._bounds = QRectF()
+        self.setZValue(-0.5)
+
+    #
+    # Public
+    #
+    def setWeighted(self, weighted: bool):
+        if weighted != self.weighted:
+            self.weighted = weighted
+            self.image = None
+            self.update()
+
+    def geometryChanged(self):
+        # Follows the bounds of the material layer, call it after the materials changed.
+        self.prepareGeometryChange()
+        self._bounds = self.materials.boundingRect()
+        self.update()
+
+    def boundingRect(self):
+        return self._bounds
+
+    def paint(self, painter, option: QStyleOptionGraphicsItem, widget=None):
+        # Binned over the whole device, see needsBinning.
+        visible = deviceSceneRect(painter)
+        if visible is None:
+            return
+        transform = painter.worldTransform()
+        scale = math.hypot(transform.m11(), transform.m12())
+        if self.needsBinning(visible, scale):
+            self.bin(visible, scale)
+        if self.image is not None:
+            painter.drawImage(self.imageRect, self.image)
+
+    #
+    # Private
+    #
+    def needsBinning(self, visible: QRectF, scale: float):
+        if self.image is None or self._imageKey != (self.materials.version, self.weighted):
+            return True
+        ratio = scale / self._imageScale
+        return not self.imageRect.contains(visible) or max(ratio, 1. / ratio) > DENSITY_REBIN_ZOOM_RATIO
+
+    def bin(self, visible: QRectF, scale: float):
+        margin_x = visible.width() * DENSITY_MARGIN_RATIO
+        margin_y = visible.height() * DENSITY_MARGIN_RATIO
+        rect = visible.adjusted(-margin_x, -margin_y, margin_x, margin_y)
+        columns = int(min(DENSITY_MAX_BINS, max(1, math.ceil(rect.width() * scale / DENSITY_CELL_PX))))
+        rows = int(min(DENSITY_MAX_BINS, max(1, math.ceil(rect.height() * scale / DENSITY_CELL_PX))))
+        x, y, w, h = self.materials.rects[self.materials.drawnRows()].T
+        weights = np.abs(w * h) if self.weighted else None
+        finite = np.isfinite(x) & np.isfinite(y) & np.isfinite(w) & np.isfinite(h)
+        if weights is not None:
+            weights = weights[finite]
+        counts, _, _ = np.histogram2d((y + h / 2.)[finite], (x + w / 2.)[finite], bins=(rows, columns),
+                                      range=((rect.top(), rect.bottom()), (rect.left(), rect.right())),
+                                      weights=weights)
+        self.image = self.colorize(counts)
+        self.imageRect = rect
+        self._imageKey = (self.materials.version, self.weighted)
+        self._imageScale = scale
+
+    @staticmethod
+    def colorize(counts: np.ndarray):
+        '''
+        RGBA image of a histogram on a log scale, empty bins are transparent.
+        '''
+        peak = counts.max()
+        level = np.log1p(counts) / math.log1p(peak) if peak > 0 else counts
+        stops = np.linspace(0., 1., len(DENSITY_COLORS))
+        rgba = np.empty(counts.shape + (4,), dtype=np.uint8)
+        for channel in range(4):
+            rgba[..., channel] = np.interp(level, stops, DENSITY_COLORS[:, channel])
+        rgba[counts <= 0] = 0
+        height, width = counts.shape
+        pixels = rgba.tobytes()
+        # The QImage shares the buffer it was built from, copy it so the image owns its pixels.
+        return QImage(pixels, width, height, width * 4, QImage.Format_RGBA8888).copy()
@@ -0,0 +1,196 @@
+# -*- coding:utf-8 -*-
+# @ModuleName: LabelLayer
+
+import numpy as np
+from PySide2.QtWidgets import QGraphicsItem, QStyleOptionGraphicsItem
+from PySide2.QtGui import QColor, QFont, QFontMetricsF, QPen, QStaticText
+from PySide2.QtCore import QPointF, QRectF
+
+from .MaterialLayer import GridIndex, deviceSceneRect
+
+LABEL_FONT = QFont("Arial", 12, 2)
+LABEL_COLOR = QColor(0, 0, 0)
+# Offset of the text from its anchor and the free space kept around a placed label, in pixels.
+LABEL_PADDING_PX = 4
+# Side of the screen grid used to find overlapping labels, in pixels.
+LABEL_CELL_PX = 48
+# At most this many labels are painted, trying at most MAX_LABEL_CANDIDATES of the visible ones.
+MAX_LABELS = 300
+MAX_LABEL_CANDIDATES = 20 * MAX_LABELS
+
+
+class LabelLayer(QGraphicsItem):
+    """
+    One scene item painting the material labels at a fixed pixel size.
+    On every repaint the visible labels are placed by priority (selection first, then ellipse size)
+    and a label overlapping an already placed one is skipped. Text is only laid out for placed labels.
+    """
+
+    def __init__(self, parent=None):
+        super(LabelLayer, self).__init__(parent)
+        self.font = LABEL_FONT
+        self.metrics = QFontMetricsF(self.font)
+        self.pen = QPen(LABEL_COLOR)
+        self.anchors = np.empty((0, 2))
+        self.labels = np.empty(0, dtype=object)
+        self.priorities = np.empty(0)
+        self.widths = np.empty(0)
+        self.drawn = np.zeros(0, dtype=bool)
+        self.selected = np.zeros(0, dtype=bool)
+        self.staticTexts = {}
+        self.viewScale = 100.0
+        self._index = None
+        self._placement = (None, [])
+        self._bounds = QRectF()
+        self.setZValue(100)
+        self.setFlag(QGraphicsItem.ItemUsesExtendedStyleOption)
+
+    #
+    # Public
+    #
+    def setLabels(self, anchors: np.ndarray, labels: np.ndarray, priorities: np.ndarray, rows=()):
+        '''
+        Replace the labels of all rows, anchored at the upper-left corner of their text.
+        Only `rows` are drawn afterwards, larger priorities win when labels overlap.
+        '''
+        self.anchors = np.asarray(anchors, dtype=np.float64)
+        self.labels = np.asarray(labels, dtype=object)
+        self.priorities = np.nan_to_num(np.asarray(priorities, dtype=np.float64))
+        self.widths = np.full(len(self.labels), np.nan)
+        self.drawn = np.zeros(len(self.labels), dtype=bool)
+        self.drawn[np.asarray(rows, dtype=np.intp)] = True
+        self.selected = np.zeros(len(self.labels), dtype=bool)
+        self.staticTexts = {}
+        self.labelsChanged()
+
+    def updateAnchors(self, anchors: np.ndarray, priorities: np.ndarray):
+        '''
+        Move the same labels to new anchors, their text layout, drawn rows and selection are kept.
+        '''
+        self.anchors = np.asarray(anchors, dtype=np.float64)
+        self.priorities = np.nan_to_num(np.asarray(priorities, dtype=np.float64))
+        self.labelsChanged()
+
+    def showRows(self, rows):
+        rows = np.asarray(rows, dtype=np.intp)
+        if len(rows) and not self.drawn[rows].all():
+            self.drawn[rows] = True
+            # Showing labels can only grow the bounds.
+            self.labelsChanged(self._bounds.united(self.labelBounds(rows)))
+
+    def clear(self):
+        if self.drawn.any():
+            self.drawn[:] = False
+            self.labelsChanged()
+
+    def setSelectedRows(self, rows):
+        self.selected[:] = False
+        self.selected[np.asarray(rows, dtype=np.intp)] = True
+        self._placement = (None, [])
+        self.update()
+
+    def setViewScale(self, view_scale: float):
+        # The pixel-sized labels reach farther into the scene when zoomed out.
+        self.prepareGeometryChange()
+        self.viewScale = view_scale
+        self._bounds = self.labelBounds()
+
+    def boundingRect(self):
+        return self._bounds
+
+    def paint(self, painter, option: QStyleOptionGraphicsItem, widget=None):
+        visible = deviceSceneRect(painter)
+        if visible is None:
+            return
+        transform = painter.worldTransform()
+        # Placed over the whole device, so partial repaints reuse one placement.
+        key = (transform.m11(), transform.m12(), transform.m21(), transform.m22(), transform.dx(), transform.dy(),
+               visible.width(), visible.height())
+        if self._placement[0] != key:
+            self._placement = (key, self.place(transform, visible))
+        painter.save()
+        painter.resetTransform()
+        painter.setFont(self.font)
+        painter.setPen(self.pen)
+        for x, y, row in self._placement[1]:
+            painter.drawStaticText(QPointF(x, y), self.staticText(row))
+        painter.restore()
+
+    #
+    # Private
+    #
+    def place(self, transform, visible: QRectF):
+        '''
+        Greedy placement of the visible labels in device pixels, returns (x, y, row) of the placed ones.
+        '''
+        # Anchors slightly outside the view can still have their text inside it.
+        margin = self.labelMargin()
+        rows = self.index().query(visible.adjusted(-margin[0], -margin[1], 0., 0.))
+        if len(rows) == 0:
+            return []
+        priority = self.priorities[rows] + np.where(self.selected[rows], np.inf, 0.)
+        rows = rows[np.argsort(-priority, kind="stable")][:MAX_LABEL_CANDIDATES]
+        x, y = self.anchors[rows].T
+        xs = transform.m11() * x + transform.m21() * y + transform.dx() + LABEL_PADDING_PX
+        ys = transform.m12() * x + transform.m22() * y + transform.dy() + LABEL_PADDING_PX
+        widths = self.labelWidths(rows)
+        height = self.metrics.height()
+        occupied = {}
+        placed = []
+        for row, left, top, width in zip(rows.tolist(), xs.tolist(), ys.tolist(), widths.tolist()):
+            box = (left - LABEL_PADDING_PX, top - LABEL_PADDING_PX, left + width + LABEL_PADDING_PX,
+                   top + height + LABEL_PADDING_PX)
+            cells = [(cell_x, cell_y)
+                     for cell_x in range(int(box[0] // LABEL_CELL_PX), int(box[2] // LABEL_CELL_PX) + 1)
+                     for cell_y in range(int(box[1] // LABEL_CELL_PX), int(box[3] // LABEL_CELL_PX) + 1)]
+            if any(box[0] < other[2] and other[0] < box[2] and box[1] < other[3] and other[1] < box[3]
+                   for cell in cells for other in occupied.get(cell, ())):
+                continue
+            for cell in cells:
+                occupied.setdefault(cell, []).append(box)
+            placed.append((left, top, row))
+            if len(placed) >= MAX_LABELS:
+                break
+        return placed
+
+    def labelWidths(self, rows: np.ndarray):
+        missing = rows[np.isnan(self.widths[rows])]
+        for row in missing.tolist():
+            self.widths[row] = self.metrics.horizontalAdvance(str(self.labels[row]))
+        return self.widths[rows]
+
+    def staticText(self, row: int):
+        text = self.staticTexts.get(row)
+        if text is None:
+            text = self.staticTexts[row] = QStaticText(str(self.labels[row]))
+            text.prepare(font=self.font)
+        return text
+
+    def labelMargin(self):
+        drawn = self.drawn & ~np.isnan(self.widths)
+        width = np.max(self.widths[drawn]) if drawn.any() else 0.
+        width = max(width, self.metrics.averageCharWidth() * 32)
+        pixels = np.array([width, self.metrics.height()]) + 2 * LABEL_PADDING_PX
+        return pixels / self.viewScale
+
+    def labelBounds(self, rows=None):
+        anchors = self.anchors[self.drawn] if rows is None else self.anchors[rows]
+        anchors = anchors[np.isfinite(anchors).all(axis=1)]
+        if len(anchors) == 0:
+            return QRectF()
+        x0, y0 = anchors.min(axis=0)
+        x1, y1 = anchors.max(axis=0) + self.labelMargin()
+        return QRectF(x0, y0, x1 - x0, y1 - y0)
+
+    def index(self):
+        if self._index is None:
+            rows = np.flatnonzero(self.drawn)
+            self._index = GridIndex(np.concatenate((self.anchors[rows], self.anchors[rows]), axis=1), rows)
+        return self._index
+
+    def labelsChanged(self, bounds: QRectF = None):
+        self.prepareGeometryChange()
+        self._index = None
+        self._placement = (None, [])
+        self._bounds = self.labelBounds() if bounds is None else bounds
+        self.update()
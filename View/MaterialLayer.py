@@ -0,0 +1,263 @@
+# -*- coding:utf-8 -*-
+# @ModuleName: MaterialLayer
+
+import math
+
+import numpy as np
+from PySide2.QtWidgets import QGraphicsItem, QStyleOptionGraphicsItem
+from PySide2.QtGui import QBrush, QColor, QPen
+from PySide2.QtCore import QRectF
+
+# Average number of materials per cell of the grid index.
+GRID_ITEMS_PER_CELL = 8
+# Share of the items that fit in one cell of the grid index, in percent.
+GRID_SMALL_PERCENTILE = 98
+
+
+def deviceSceneRect(painter):
+    '''
+    Scene rect of the whole device the painter draws on, None if it cannot be mapped.
+    '''
+    device = painter.device()
+    inverse, invertible = painter.worldTransform().inverted()
+    if device is None or not invertible:
+        return None
+    return inverse.mapRect(QRectF(0., 0., device.width(), device.height()))
+
+
+class GridIndex(object):
+    '''
+    Uniform grid over the axis-aligned boxes (x0, y0, x1, y1) of many items.
+    Items are bucketed by the cell of their center, items larger than a cell are always checked.
+    '''
+
+    def __init__(self, boxes: np.ndarray, rows: np.ndarray):
+        finite = np.isfinite(boxes).all(axis=1)
+        self.boxes = boxes[finite]
+        self.rows = rows[finite]
+        count = len(self.rows)
+        self.origin = self.boxes[:, :2].min(axis=0) if count else np.zeros(2)
+        extent = (self.boxes[:, 2:].max(axis=0) - self.origin).max() if count else 0.
+        cells = max(1, int(math.sqrt(count / GRID_ITEMS_PER_CELL)))
+        half = (self.boxes[:, 2:] - self.boxes[:, :2]) / 2.
+        # Cells no smaller than most items, otherwise nearly all of them end up in the always-checked list.
+        typical = np.percentile(half.max(axis=1), GRID_SMALL_PERCENTILE) if count else 0.
+        self.cellSize = max(extent / cells, typical, 1e-12)
+        self.columns = int(extent / self.cellSize) + 2
+        large = (half > self.cellSize).any(axis=1)
+        self.large = np.flatnonzero(large)
+        small = np.flatnonzero(~large)
+        cell_xy = np.floor((self.boxes[small, :2] + half[small] - self.origin) / self.cellSize).astype(np.int64)
+        cells = cell_xy[:, 1] * self.columns + cell_xy[:, 0]
+        order = np.argsort(cells, kind="stable")
+        self.cells = cells[order]
+        self.members = small[order]
+
+    def __len__(self):
+        return len(self.rows)
+
+    def query(self, rect: QRectF):
+        '''
+        Rows whose box intersects the rect, ascending.
+        '''
+        return np.sort(self.rows[self.hits(rect)])
+
+    def count(self, rect: QRectF):
+        return len(self.hits(rect))
+
+    def hits(self, rect: QRectF):
+        '''
+        Positions in self.rows of the boxes intersecting the rect, unordered.
+        '''
+        if len(self.rows) == 0:
+            return np.empty(0, dtype=np.intp)
+        x0, y0, x1, y1 = rect.left(), rect.top(), rect.right(), rect.bottom()
+        # A small item reaches at most one cell beyond the cell of its center.
+        low = np.floor((np.array([x0, y0]) - self.origin) / self.cellSize).astype(np.int64) - 1
+        high = np.floor((np.array([x1, y1]) - self.origin) / self.cellSize).astype(np.int64) + 1
+        low = np.clip(low, 0, self.columns - 1)
+        high = np.clip(high, 0, self.columns - 1)
+        parts = [self.large]
+        for cell_y in range(low[1], high[1] + 1):
+            first = cell_y * self.columns
+            start, stop = np.searchsorted(self.cells, (first + low[0], first + high[0] + 1))
+            parts.append(self.members[start:stop])
+        candidates = np.concatenate(parts)
+        boxes = self.boxes[candidates]
+        hit = (boxes[:, 0] <= x1) & (boxes[:, 2] >= x0) & (boxes[:, 1] <= y1) & (boxes[:, 3] >= y0)
+        return candidates[hit]
+
+
+class MaterialLayer(QGraphicsItem):
+    """
+    One scene item painting the ellipses of all drawn materials.
+    It keeps the plot geometry of every material row as arrays and a mask of the drawn rows,
+    paint() only draws the rows intersecting the exposed rect, batched by brush color.
+    """
+
+    def __init__(self, parent=None):
+        super(MaterialLayer, self).__init__(parent)
+        self.pen = QPen(QColor(0, 0, 0))
+        self.pen.setWidth(0)
+        self.rects = np.empty((0, 4))
+        self.rotations = np.empty(0)
+        self.boxes = np.empty((0, 4))
+        self.colorCodes = np.empty(0, dtype=np.intp)
+        self.colors = np.empty((0, 3), dtype=np.int32)
+        self.brushes = {}
+        self.drawn = np.zeros(0, dtype=bool)
+        self._index = None
+        self._bounds = QRectF()
+        # Grows with every change of the geometry or the drawn rows.
+        self.version = 0
+        # Needed for option.exposedRect in paint().
+        self.setFlag(QGraphicsItem.ItemUsesExtendedStyleOption)
+
+    #
+    # Public
+    #
+    def setGeometry(self, rects: np.ndarray, rotations: np.ndarray, colors: np.ndarray, rows=()):
+        '''
+        Replace the geometry of all rows: rects hold (upper_left_x, upper_left_y, width, height),
+        rotations the angle in degrees around the center. Only `rows` are drawn afterwards.
+        '''
+        self.rects = np.asarray(rects, dtype=np.float64)
+        self.rotations = np.nan_to_num(np.asarray(rotations, dtype=np.float64))
+        self.boxes = self.rotatedBoxes(self.rects, self.rotations)
+        unique_colors, codes = np.unique(np.asarray(colors).reshape(-1, 3), axis=0, return_inverse=True)
+        self.colors = unique_colors
+        self.colorCodes = codes.reshape(-1)
+        self.brushes = {}
+        self.drawn = np.zeros(len(self.rects), dtype=bool)
+        self.drawn[np.asarray(rows, dtype=np.intp)] = True
+        self.geometryChanged()
+
+    def updateGeometry(self, rects: np.ndarray, rotations: np.ndarray):
+        '''
+        Move the same rows to new rects and rotations, colors and drawn rows are kept.
+        '''
+        self.rects = np.asarray(rects, dtype=np.float64)
+        self.rotations = np.nan_to_num(np.asarray(rotations, dtype=np.float64))
+        self.boxes = self.rotatedBoxes(self.rects, self.rotations)
+        self.geometryChanged()
+
+    def showRows(self, rows):
+        rows = np.asarray(rows, dtype=np.intp)
+        if len(rows) and not self.drawn[rows].all():
+            self.drawn[rows] = True
+            # Showing rows can only grow the bounds.
+            self.geometryChanged(self._bounds.united(self.rowsBounds(rows)))
+
+    def hideRows(self, rows):
+        rows = np.asarray(rows, dtype=np.intp)
+        if len(rows) and self.drawn[rows].any():
+            self.drawn[rows] = False
+            self.geometryChanged()
+
+    def clear(self):
+        self.hideRows(np.flatnonzero(self.drawn))
+
+    def drawnRows(self):
+        return np.flatnonzero(self.drawn)
+
+    def rowsIn(self, rect: QRectF):
+        '''
+        Drawn rows whose bounding box intersects the rect (scene coordinates), ascending.
+        '''
+        return self.index().query(rect)
+
+    def countIn(self, rect: QRectF):
+        return self.index().count(rect)
+
+    def rowAt(self, point):
+        '''
+        The topmost drawn row whose ellipse contains the point, -1 if there is none.
+        '''
+        rows = self.rowsIn(QRectF(point.x(), point.y(), 0., 0.))
+        if len(rows) == 0:
+            return -1
+        x, y, w, h = self.rects[rows].T
+        theta = np.radians(self.rotations[rows])
+        dx = point.x() - (x + w / 2.)
+        dy = point.y() - (y + h / 2.)
+        # Rotate the point back into the frame of each ellipse.
+        u = dx * np.cos(theta) + dy * np.sin(theta)
+        v = -dx * np.sin(theta) + dy * np.cos(theta)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            inside = (u / (w / 2.)) ** 2 + (v / (h / 2.)) ** 2 <= 1.
+        rows = rows[inside]
+        return int(rows[-1]) if len(rows) else -1
+
+    def rowsBounds(self, rows):
+        '''
+        Scene rect enclosing the ellipses of the rows, drawn or not.
+        '''
+        boxes = self.boxes[np.asarray(rows, dtype=np.intp)]
+        boxes = boxes[np.isfinite(boxes).all(axis=1)]
+        if len(boxes) == 0:
+            return QRectF()
+        x0, y0 = boxes[:, :2].min(axis=0)
+        x1, y1 = boxes[:, 2:].max(axis=0)
+        return QRectF(x0, y0, x1 - x0, y1 - y0)
+
+    def boundingRect(self):
+        return self._bounds
+
+    def paint(self, painter, option: QStyleOptionGraphicsItem, widget=None):
+        # QGraphicsScene.render() exposes the whole item, so clip to the device as well.
+        visible = deviceSceneRect(painter)
+        exposed = option.exposedRect if visible is None else option.exposedRect.intersected(visible)
+        rows = self.rowsIn(exposed)
+        if len(rows) == 0:
+            return
+        painter.setPen(self.pen)
+        codes = self.colorCodes[rows]
+        order = np.argsort(codes, kind="stable")
+        rows = rows[order]
+        codes = codes[order]
+        starts = np.flatnonzero(np.diff(codes)) + 1
+        for group, code in zip(np.split(rows, starts), codes[np.concatenate(([0], starts))]):
+            painter.setBrush(self.brush(code))
+            for (x, y, w, h), angle in zip(self.rects[group].tolist(), self.rotations[group].tolist()):
+                if angle:
+                    painter.save()
+                    painter.translate(x + w / 2., y + h / 2.)
+                    painter.rotate(angle)
+                    painter.drawEllipse(QRectF(-w / 2., -h / 2., w, h))
+                    painter.restore()
+                else:
+                    painter.drawEllipse(QRectF(x, y, w, h))
+
+    #
+    # Private
+    #
+    @staticmethod
+    def rotatedBoxes(rects: np.ndarray, rotations: np.ndarray):
+        x, y, w, h = rects.T
+        theta = np.radians(rotations)
+        half_w = np.hypot(w / 2. * np.cos(theta), h / 2. * np.sin(theta))
+        half_h = np.hypot(w / 2. * np.sin(theta), h / 2. * np.cos(theta))
+        center_x = x + w / 2.
+        center_y = y + h / 2.
+        return np.stack((center_x - half_w, center_y - half_h, center_x + half_w, center_y + half_h), axis=1)
+
+    def brush(self, code: int):
+        brush = self.brushes.get(code)
+        if brush is None:
+            r, g, b = (int(value) for value in self.colors[code])
+            brush = self.brushes[code] = QBrush(QColor(r, g, b, a=255))
+        return brush
+
+    def index(self):
+        if self._index is None:
+            rows = self.drawnRows()
+            self._index = GridIndex(self.boxes[rows], rows)
+        return self._index
+
+    def geometryChanged(self, bounds: QRectF = None):
+        self.prepareGeometryChange()
+        # The index is built again on the next query, so a series of changes only builds it once.
+        self._index = None
+        self.version += 1
+        self._bounds = self.rowsBounds(self.drawnRows()) if bounds is None else bounds
+        self.update()
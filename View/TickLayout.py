@@ -0,0 +1,145 @@
+# -*- coding:utf-8 -*-
+# @ModuleName: TickLayout
+
+import math
+
+import numpy as np
+
+from AlgorithmUtils import LRUCache
+
+TICK_MODE_LINEAR = 0
+TICK_MODE_LOGSCALE = 1
+
+MINOR_TICK_COUNT = 10
+# Ticks are computed for a window of this many major steps around the view, so panning reuses them.
+TICK_WINDOW_STEPS = 16
+TICK_CACHE_SIZE = 64
+# Log axes are clipped to these decades to keep 10 ** x finite.
+LOG_DECADE_LIMIT = 300
+
+
+class TickLayout(object):
+    '''
+    Major and minor tick positions of one axis window in scene coordinates, ascending,
+    and the label of every major tick.
+    '''
+
+    def __init__(self, majors: np.ndarray, minors: np.ndarray, labels: list):
+        order = np.argsort(majors, kind="stable")
+        self.majors = majors[order]
+        self.labels = [labels[i] for i in order]
+        self.minors = np.sort(minors)
+
+    def visible(self, lower: float, upper: float):
+        '''
+        Majors, minors and labels within [lower, upper].
+        '''
+        start = np.searchsorted(self.majors, lower, side="left")
+        stop = np.searchsorted(self.majors, upper, side="right")
+        minor_start = np.searchsorted(self.minors, lower, side="left")
+        minor_stop = np.searchsorted(self.minors, upper, side="right")
+        return self.majors[start:stop], self.minors[minor_start:minor_stop], self.labels[start:stop]
+
+
+def tickLevel(span: float):
+    '''
+    Exponent of the major step for a visible span: 2 to 20 major ticks are in view.
+    '''
+    level = math.floor(math.log10(span))
+    if span / 10 ** level < 2:
+        level -= 1
+    return level
+
+
+def uniformTicks(lower: float, upper: float, step: float):
+    first, last = math.ceil(lower / step), math.floor(upper / step)
+    majors = np.arange(first, last + 1) * step
+    minors = (np.arange(first - 1, last + 1)[:, None] * step
+              + np.arange(1, MINOR_TICK_COUNT) * step / MINOR_TICK_COUNT).ravel()
+    return majors, minors[(minors >= lower) & (minors <= upper)]
+
+
+def computeTicks(mode: int, lower: float, upper: float, level: int, value_level: int = None):
+    '''
+    Ticks of the axis coordinate range [lower, upper]; on a log axis the coordinate is log10 of the value.
+    Returns (majors, minors, major values).
+    '''
+    step = 10. ** level
+    if mode == TICK_MODE_LINEAR:
+        majors, minors = uniformTicks(lower, upper, step)
+        return majors, minors, majors
+    if level > 0:
+        # Many decades: evenly spaced decades.
+        majors, minors = uniformTicks(lower, upper, step)
+        return majors, minors, 10. ** majors
+    decades = np.arange(math.floor(lower), math.floor(upper) + 1, dtype=np.float64)
+    if level == 0:
+        # A few decades: a major tick per decade, minor ticks at 2..9 times the decade.
+        majors = decades[(decades >= lower) & (decades <= upper)]
+        minors = (decades[:, None] + np.log10(np.arange(2, MINOR_TICK_COUNT))).ravel()
+        return majors, minors[(minors >= lower) & (minors <= upper)], 10. ** majors
+    if level == -1:
+        # About a decade: major ticks at 1..9 times the decade, minor ticks at the tenths in between.
+        multiples = np.arange(1, 10) * 10. ** decades[:, None]
+        values = multiples.ravel()
+        minor_values = (multiples[:, :, None] * (1. + np.arange(1, MINOR_TICK_COUNT) / MINOR_TICK_COUNT)).ravel()
+    else:
+        # Within a decade: evenly spaced values.
+        values, minor_values = uniformTicks(10. ** lower, 10. ** upper, 10. ** value_level)
+        values = values[values > 0]
+        minor_values = minor_values[minor_values > 0]
+    majors = np.log10(values)
+    minors = np.log10(minor_values)
+    keep = (majors >= lower) & (majors <= upper)
+    return majors[keep], minors[(minors >= lower) & (minors <= upper)], values[keep]
+
+
+class TickEngine(object):
+    '''
+    Memoized tick layouts keyed on (mode, direction, step level, window). The window is a block of
+    TICK_WINDOW_STEPS major steps, so the axis and its grid lines share one computation and small
+    pans and zooms within the same level are cache hits.
+    '''
+
+    def __init__(self, max_entries: int = TICK_CACHE_SIZE):
+        self.entries = LRUCache(max_entries)
+
+    def layout(self, mode: int, lower: float, upper: float, flipped: bool = False):
+        '''
+        TickLayout covering the scene range [lower, upper]. A flipped axis shows the value -scene,
+        e.g. the y axis of the plot.
+        '''
+        if flipped:
+            lower, upper = -upper, -lower
+        span = upper - lower
+        if not span > 0 or not math.isfinite(span):
+            return TickLayout(np.empty(0), np.empty(0), [])
+        if mode == TICK_MODE_LOGSCALE:
+            lower = max(lower, -LOG_DECADE_LIMIT)
+            upper = min(upper, LOG_DECADE_LIMIT)
+            span = max(upper - lower, 1e-12)
+        level = tickLevel(span)
+        value_level = None
+        if mode == TICK_MODE_LOGSCALE and level < -1:
+            value_level = tickLevel(10. ** upper - 10. ** lower)
+        block = TICK_WINDOW_STEPS * 10. ** level
+        first, last = math.floor(lower / block), math.floor(upper / block)
+        key = (mode, flipped, level, value_level, first, last)
+        layout = self.entries.get(key)
+        if layout is not None:
+            return layout
+        window_lower, window_upper = first * block, (last + 1) * block
+        if mode == TICK_MODE_LOGSCALE:
+            window_lower = max(window_lower, -LOG_DECADE_LIMIT)
+            window_upper = min(window_upper, LOG_DECADE_LIMIT)
+        majors, minors, values = computeTicks(mode, window_lower, window_upper, level, value_level)
+        labels = ["%g" % value for value in values.tolist()]
+        if flipped:
+            majors, minors = -majors, -minors
+        layout = TickLayout(majors, minors, labels)
+        self.entries.put(key, layout)
+        return layout
+
+
+# One engine for every axis item, so an axis and its grid lines compute their ticks once.
+TICK_ENGINE = TickEngine()
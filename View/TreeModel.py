@@ -43,3 +43,9 @@ class TreeItemModel(QStandardItemModel):
         item = TreeItem(label)
         familyitem.appendRow(item)
         return item
+
+    def addItemsByFamily(self, family, labels):
+        # Appends all labels of a family at once instead of searching the family item per label.
+        familyitem = self.addFamily(family)
+        familyitem.appendRows([TreeItem(label) for label in labels])
+        return familyitem
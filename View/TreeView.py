@@ -31,5 +31,8 @@ class TreeView(QTreeView):
         for family in families:
             self.model.addFamily(family)
 
+    def addFamilyItems(self, family, labels):
+        self.model.addItemsByFamily(family, labels)
+
     def addItem(self, item, family=None):
         self.model.addItemByFamily(item.label, family)
@@ -1,13 +1,17 @@
 # -*- coding:utf-8 -*-
+import os
 import sys
 from typing import List
 
-from PySide2.QtCore import QFile, QRectF, QPointF
+from PySide2.QtCore import QFile, QFileSystemWatcher, QRectF, QPointF
 from PySide2.QtUiTools import QUiLoader
-from PySide2.QtWidgets import QApplication, QMainWindow, QGraphicsScene, QFileDialog, QTreeView, QDialog
+from PySide2.QtWidgets import QApplication, QMainWindow, QGraphicsScene, QFileDialog, QTreeView, QDialog, QProgressBar, \
+    QPushButton, QActionGroup
 from PySide2.QtGui import QBrush, QPen, QColor, QFont
 
-from GraphicsModule import AshbyGraphicsController
+from DataCache import DataCache
+from GraphicsModule import AshbyGraphicsController, DENSITY_AUTO, DENSITY_ON, DENSITY_OFF
+from ModelLoader import ModelLoader
 from View.AGraphicsView import AGraphicsView
 from View.TreeView import TreeView
 
@@ -24,9 +28,28 @@ class MainWindow(QMainWindow):
         loader.registerCustomWidget(AGraphicsView)
         loader.registerCustomWidget(TreeView)
         self.ui = loader.load(file)
+        self.controller = None
         self.connectSignals()
         self.ui.show()
         self.csv_fpath = None
+        self.dataCache = DataCache()
+        # Datasets are loaded in the background, the current one stays usable until the new one is ready.
+        self.loader = ModelLoader(self.dataCache)
+        self.loader.progress.connect(self.onLoadProgress)
+        self.loader.loaded.connect(self.onModelLoaded)
+        self.loader.failed.connect(self.onLoadFailed)
+        self.loader.cancelled.connect(self.onLoadCancelled)
+        # What was drawn when the watched CSV got rewritten, restored once it is loaded again.
+        self.reloadState = None
+        self.loadProgressBar = QProgressBar()
+        self.loadProgressBar.setMaximumWidth(200)
+        self.cancelLoadButton = QPushButton("Cancel")
+        self.cancelLoadButton.clicked.connect(self.loader.cancel)
+        self.ui.statusbar.addPermanentWidget(self.loadProgressBar)
+        self.ui.statusbar.addPermanentWidget(self.cancelLoadButton)
+        self.showLoadWidgets(False)
+        self.watcher = QFileSystemWatcher()
+        self.watcher.fileChanged.connect(self.onWatchedFileChanged)
         self.myScene = QGraphicsScene()
         self.ui.graphicsView.setScene(self.myScene)
         self.controller = AshbyGraphicsController(self, self.csv_fpath)
@@ -42,6 +65,8 @@ class MainWindow(QMainWindow):
         self.ui.Plot_clear.clicked.connect(self.onActionClear)
         # TODO(ky): update the ui nameing style in the menu to be consistent with the buttons.
         self.ui.actionOpen_CSV.triggered.connect(self.onActionOpenCSV)
+        self.ui.actionOpen_Folder.triggered.connect(self.onActionOpenFolder)
+        self.ui.actionWatchCSV.toggled.connect(self.updateWatcher)
         self.ui.actionHotReload.triggered.connect(self.onActionHotReload)
         self.ui.actionConvexHull.triggered.connect(self.onActionConvexHull)
         self.ui.actionGenerateChart.triggered.connect(self.onClickGenPropChrt)
@@ -51,13 +76,22 @@ class MainWindow(QMainWindow):
         self.ui.actionFitView.triggered.connect(self.onFitView)
         self.ui.buttonGroup.buttonToggled.connect(self.onAxisStyleChanged)
         self.ui.actionAxes.triggered.connect(self.onDefineAxes)
+        self.ui.graphicsView.viewScaleChanged.connect(self.onViewScaleChanged)
+        self.ui.graphicsView.viewportChanged.connect(self.onViewportChanged)
+        self.ui.actionClearCache.triggered.connect(self.onActionClearCache)
+        # The density modes are exclusive, the weighting applies to any of them.
+        self.densityActions = QActionGroup(self)
+        for action in (self.ui.actionDensityAuto, self.ui.actionDensityOn, self.ui.actionDensityOff):
+            self.densityActions.addAction(action)
+        self.densityActions.triggered.connect(self.applyDensityMode)
+        self.ui.actionDensityWeighted.toggled.connect(self.applyDensityMode)
 
     #
     # Button and menu functions, called upon UI interactions.
     #
 
     def onDefineAxes(self):
-        pop_up = setAxesPopUp(self.controller.model.getNumericColumns(self.csv_fpath))
+        pop_up = setAxesPopUp(self.controller.model.getNumericColumns())
         pop_up.exec_()
         if pop_up.returnNewXY():
             self.controller.updateObjectsByAxis(pop_up.returnNewXY())
@@ -76,7 +110,10 @@ class MainWindow(QMainWindow):
         app.processEvents()
 
     def onFitView(self):
-        self.ui.graphicsView.fitView()
+        if self.controller is not None:
+            self.controller.fitView()
+        else:
+            self.ui.graphicsView.fitView()
         app.processEvents()
 
     def onActionHotReload(self):
@@ -88,6 +125,7 @@ class MainWindow(QMainWindow):
         from GraphicsModule import AshbyGraphicsController
         from DataModel import AshbyModel
         self.controller = AshbyGraphicsController(self, self.csv_fpath)
+        self.applyDensityMode()
 
     def onClickGenPropChrt(self):
         '''
@@ -104,8 +142,111 @@ class MainWindow(QMainWindow):
         print("Ready to input data.")
         filename, _ = QFileDialog.getOpenFileName(self, "Open CSV", filter="CSV Files (*.csv)")
         if filename:
-            self.csv_fpath = filename
-        self.controller = AshbyGraphicsController(self, self.csv_fpath)
+            self.loadDataset(filename)
+
+    def onActionOpenFolder(self):
+        '''
+        Loads every CSV file of a folder as one dataset.
+        '''
+        dirname = QFileDialog.getExistingDirectory(self, "Open CSV Folder")
+        if dirname:
+            self.loadDataset(dirname)
+
+    def loadDataset(self, filename: str):
+        '''
+        Starts loading a CSV file or folder in the background, see onModelLoaded.
+        '''
+        self.reloadState = None
+        self.loader.load(filename)
+        self.loadProgressBar.setValue(0)
+        self.showLoadWidgets(True)
+        self.ui.statusbar.showMessage("Loading %s ..." % filename)
+
+    def onModelLoaded(self, filename: str, model):
+        '''
+        Swaps the loaded dataset in, replacing the controller of the previous one.
+        '''
+        self.showLoadWidgets(False)
+        self.csv_fpath = filename
+        self.controller = AshbyGraphicsController(self, self.csv_fpath, model)
+        self.applyDensityMode()
+        if self.reloadState is not None:
+            self.controller.restoreDrawnState(self.reloadState)
+            self.reloadState = None
+        self.updateWatcher()
+        if model.loadErrors:
+            self.ui.statusbar.showMessage("%d file(s) could not be loaded, see the console." % len(model.loadErrors))
+        else:
+            self.ui.statusbar.showMessage("Loaded %s." % filename)
+
+    def onLoadFailed(self, filename: str, message: str):
+        self.showLoadWidgets(False)
+        print("Failed to load %s: %s" % (filename, message))
+        self.ui.statusbar.showMessage("Could not load %s: %s" % (filename, message))
+
+    def onLoadCancelled(self, filename: str):
+        self.showLoadWidgets(False)
+        self.ui.statusbar.showMessage("Loading %s cancelled." % filename)
+
+    def showLoadWidgets(self, visible: bool):
+        self.loadProgressBar.setVisible(visible)
+        self.cancelLoadButton.setVisible(visible)
+
+    def updateWatcher(self, _=None):
+        '''
+        Watches the opened CSV file while "Watch CSV for Appended Rows" is checked.
+        '''
+        if self.watcher.files():
+            self.watcher.removePaths(self.watcher.files())
+        if self.ui.actionWatchCSV.isChecked() and self.csv_fpath and os.path.isfile(self.csv_fpath):
+            self.watcher.addPath(self.csv_fpath)
+
+    def onWatchedFileChanged(self, path: str):
+        if not self.controller.refreshData():
+            # Rewritten rather than appended to, load it again in the background like a newly opened file.
+            state = self.controller.drawnState()
+            self.loadDataset(self.csv_fpath)
+            self.reloadState = state
+        # Some writers replace the file, which drops it from the watcher.
+        self.updateWatcher()
+
+    def onViewScaleChanged(self, view_scale: float):
+        self.controller.onViewScaleChanged(view_scale)
+
+    def onViewportChanged(self):
+        # The view is shown and resized before the first controller exists.
+        if self.controller is not None:
+            self.controller.onViewportChanged()
+
+    def applyDensityMode(self, _=None):
+        '''
+        Hands the mode checked in View > Density Map to the controller.
+        '''
+        if self.ui.actionDensityOn.isChecked():
+            mode = DENSITY_ON
+        elif self.ui.actionDensityOff.isChecked():
+            mode = DENSITY_OFF
+        else:
+            mode = DENSITY_AUTO
+        self.controller.setDensityMode(mode, self.ui.actionDensityWeighted.isChecked())
+
+    def onLoadProgress(self, filename: str, read_bytes: int, total_bytes: int):
+        '''
+        Shows the CSV ingestion progress in the status bar.
+        '''
+        if filename != self.loader.filename:
+            # Reported by a load which has been cancelled since.
+            return
+        percent = 100. * read_bytes / total_bytes if total_bytes else 100.
+        self.loadProgressBar.setValue(int(percent))
+        self.ui.statusbar.showMessage("Loading %s ... %d%%" % (filename, percent))
+
+    def onActionClearCache(self):
+        '''
+        Drops the cached aggregated tables so the next load parses the CSV again.
+        '''
+        self.dataCache.invalidate()
+        self.ui.statusbar.showMessage("Data cache cleared.")
 
     def onClickPlotSelLn(self):
         self.controller.drawLine()
@@ -175,4 +316,5 @@ class setAxesPopUp(QDialog):
 if __name__ == '__main__':
     app = QApplication(sys.argv)
     window = MainWindow()
+    app.aboutToQuit.connect(window.loader.shutdown)
     sys.exit(app.exec_())